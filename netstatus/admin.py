@@ -6,3 +6,4 @@ admin.site.register(Voip)
 admin.site.register(Surveillance)
 admin.site.register(Switches)
 admin.site.register(Wifi)
+admin.site.register(ProbeJob)
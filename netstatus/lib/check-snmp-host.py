@@ -1,4 +1,4 @@
-from netstatus.lib.snmp import SNMP
+from netstatus.lib.snmp import pool
 
 
 def probe_snmp_host(host, community, oper, oid, values=[]):
@@ -13,16 +13,19 @@ def probe_snmp_host(host, community, oper, oid, values=[]):
     if community is None or community == '':
         community = 'public'
 
-    snmp = SNMP(host, community)
-    if oper == 'get':
-        yield snmp.get(oid)
-    elif oper == 'walk':
-        yield '\n'.join([i for i in snmp.walk(oid)])
-    else:
-        value = values[0]
-        try:
-            value_type = values[1]
-        except:
-            value_type = None
-        yield snmp.set(oid, value, value_type)
+    snmp = pool.acquire(host, community)
+    try:
+        if oper == 'get':
+            yield snmp.get(oid)
+        elif oper == 'walk':
+            yield '\n'.join([i for i in snmp.walk(oid)])
+        else:
+            value = values[0]
+            try:
+                value_type = values[1]
+            except:
+                value_type = None
+            yield snmp.set(oid, value, value_type)
+    finally:
+        pool.release(snmp)
     return
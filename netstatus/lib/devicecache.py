@@ -0,0 +1,84 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+
+from netstatus.settings import Settings
+
+
+class DeviceCache:
+    """
+    Slow changing data of each switch kept between probes: the resolved Switch subclass, the baseport <-> ifIndex
+    map and the entPhysical data (serial, model, vendor, ...). Entries are keyed by the bridge MAC and stored as a
+    JSON file in Settings.DEVICE_CACHE.
+
+    An entry is only trusted while sysDescr is the same and sysUpTime keeps growing. A reboot, a firmware upgrade or
+    another switch answering in the same IP makes the switch go through the whole discovery again.
+
+    Several processes may share the file (probe shards, probeworkers): save() merges the changes of this instance
+    into the file on disk, under a lock, instead of writing its whole copy over the others.
+    """
+    def __init__(self, path=None):
+        self.path = path if path is not None else Settings.DEVICE_CACHE
+        # changes since the last save(): mac -> entry, or None for a dropped entry
+        self._changes = {}
+        self.entries = self._read()
+
+    def _read(self):
+        if self.path and os.path.isfile(self.path):
+            try:
+                with open(self.path) as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                logging.warning('DeviceCache: ignoring {}: {}'.format(self.path, e))
+        return {}
+
+    def get(self, mac, descr, uptime):
+        """
+        :param mac: bridge MAC, formatted by format_mac()
+        :param descr: sysDescr
+        :param uptime: sysUpTime in milliseconds, as Switch.uptime
+        :return: the entry or None, when it doesn't exist or isn't valid anymore (the entry is dropped)
+        """
+        entry = self.entries.get(mac)
+        if entry is None:
+            return None
+        if entry['descr'] != descr or uptime < entry['uptime']:
+            logging.debug('DeviceCache: {} changed, dropping entry'.format(mac))
+            del self.entries[mac]
+            self._changes[mac] = None
+            return None
+        return entry
+
+    def put(self, mac, entry):
+        if mac:
+            self.entries[mac] = entry
+            self._changes[mac] = entry
+
+    def save(self):
+        """
+        Merge the changes of this instance with the file, as saved by other processes meanwhile, and write it. The old
+        file is only replaced when the new one is complete.
+        """
+        if not self.path or not self._changes:
+            return
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            entries = self._read()
+            for mac, entry in self._changes.items():
+                if entry is None:
+                    entries.pop(mac, None)
+                else:
+                    entries[mac] = entry
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, self.path)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        self.entries = entries
+        self._changes = {}
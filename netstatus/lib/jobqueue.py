@@ -0,0 +1,161 @@
+"""
+    Probe jobs kept in the database (models.ProbeJob), shared by any number of probeworker processes on any host.
+    A worker claims the due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so two workers never take the same job, and
+    holds them for a lease (Settings.PROBE_JOB_LEASE). If the worker dies, the jobs are claimed again by another one
+    when the lease expires.
+"""
+import os
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from netstatus.lib import probe
+from netstatus.lib.devicecache import DeviceCache
+from netstatus.models import ProbeJob, Switches
+from netstatus.settings import Settings
+
+
+def owner_name():
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+def next_due(profile, now, attempts, ok, intervals=None, jitter=None):
+    """
+    :param attempts: attempts of the job so far, counting this one
+    :param ok: the switch was loaded
+    :return: when the job is due again: the interval of the profile (with jitter), or a retry after a failure
+    """
+    intervals = Settings.PROBED_INTERVALS if intervals is None else intervals
+    jitter = Settings.PROBED_JITTER if jitter is None else jitter
+    if not ok and attempts < Settings.PROBE_JOB_ATTEMPTS:
+        return now + timedelta(seconds=Settings.PROBE_JOB_RETRY * 2 ** (attempts - 1))
+    return now + timedelta(seconds=intervals[profile] * random.uniform(1 - jitter / 100, 1 + jitter / 100))
+
+
+def schedule(intervals=None):
+    """
+    Create the missing jobs, due now: one per active switch and load profile with an interval.
+    Any worker may run it: the jobs already there (unique switch / profile) are ignored.
+    :return: number of jobs created
+    """
+    intervals = Settings.PROBED_INTERVALS if intervals is None else intervals
+    profiles = [profile for profile, interval in intervals.items() if interval]
+    existing = set(ProbeJob.objects.values_list('switch_id', 'profile'))
+    now = timezone.now()
+    jobs = [ProbeJob(switch_id=switchid, profile=profile, due=now)
+            for switchid in Switches.objects.filter(status='active').values_list('id', flat=True)
+            for profile in profiles if (switchid, profile) not in existing]
+    ProbeJob.objects.bulk_create(jobs, ignore_conflicts=True)
+    return len(jobs)
+
+
+def claim(owner, limit, lease=None):
+    """
+    Take up to `limit` due jobs of active switches, oldest first, skipping the ones locked by other workers.
+    A job whose lease expired PROBE_JOB_ATTEMPTS times (the worker died with it) isn't taken: it waits for the next
+    interval.
+    :return: [ProbeJob], with the switch already fetched
+    """
+    now = timezone.now()
+    lease = Settings.PROBE_JOB_LEASE if lease is None else lease
+    claimed = []
+    with transaction.atomic():
+        jobs = list(ProbeJob.objects.select_for_update(skip_locked=True, of=('self',)).select_related('switch').
+                    filter(Q(lease_until__isnull=True) | Q(lease_until__lt=now), due__lte=now,
+                           switch__status='active').order_by('due')[:limit])
+        for job in jobs:
+            if job.attempts >= Settings.PROBE_JOB_ATTEMPTS:
+                job.last_error = 'lease expired {} times'.format(job.attempts)
+                job.due = next_due(job.profile, now, job.attempts, False)
+                job.attempts = 0
+                job.lease_owner = job.lease_until = None
+                continue
+            job.attempts += 1
+            job.lease_owner = owner
+            job.lease_until = now + timedelta(seconds=lease)
+            claimed.append(job)
+        ProbeJob.objects.bulk_update(jobs, ('due', 'attempts', 'lease_owner', 'lease_until', 'last_error'))
+    return claimed
+
+
+def finish(jobs, response, owner):
+    """
+    Release the jobs after the probe, scheduling them again. The jobs whose lease was lost meanwhile (taken by another
+    worker) are left alone.
+    :param response: ProbeResponse of the probe of these jobs
+    """
+    now = timezone.now()
+    for job in jobs:
+        ok = job.switch.ip in response.saved
+        msgs = response.hosts.get(job.switch.ip)
+        ProbeJob.objects.filter(id=job.id, lease_owner=owner).update(
+            due=next_due(job.profile, now, job.attempts, ok),
+            attempts=0 if ok or job.attempts >= Settings.PROBE_JOB_ATTEMPTS else job.attempts,
+            lease_owner=None, lease_until=None, last_error='' if ok else str(msgs[-1] if msgs else 'failed')[:200])
+
+
+class ProbeWorker:
+    # seconds to sleep when there is no job due
+    tick = 5
+
+    def __init__(self, owner=None, batch=None, dryrun=False, output=None):
+        """
+        :param owner: name of this worker in the leases. None is hostname:pid.
+        :param batch: jobs claimed at once. None uses Settings.PROBE_CONCURRENCY.
+        :param dryrun: don't save the switches into the database (the jobs are still rescheduled)
+        :param output: called with (profile, ProbeResponse) after each run
+        """
+        self.owner = owner if owner else owner_name()
+        self.batch = batch if batch else Settings.PROBE_CONCURRENCY
+        self.dryrun = dryrun
+        self.output = output
+        self.running = False
+        self.scheduled = None
+        self.cache = DeviceCache()
+        self.db_executor = ThreadPoolExecutor(max_workers=Settings.PROBE_WRITERS, thread_name_prefix='probe-db')
+
+    def run_once(self):
+        """
+        Claim and probe one batch of jobs.
+        :return: number of jobs probed
+        """
+        close_old_connections()
+        if self.scheduled is None or time.time() - self.scheduled >= Settings.PROBED_REFRESH:
+            schedule()
+            self.scheduled = time.time()
+        jobs = claim(self.owner, self.batch)
+        profiles = {}
+        for job in jobs:
+            profiles.setdefault(job.profile, []).append(job)
+        for profile, profile_jobs in profiles.items():
+            rows = [(job.switch.ip, job.switch.stp_root, job.switch.community_ro, job.switch.id,
+                     job.switch.snmp_max_repetitions, job.switch.probe_deadline) for job in profile_jobs]
+            probe.on_db_workers(self.db_executor, Settings.PROBE_WRITERS, close_old_connections)
+            response = probe._switch_status(rows, self.dryrun, profile, self.cache, self.db_executor)
+            finish(profile_jobs, response, self.owner)
+            if self.output:
+                self.output(profile, response)
+        return len(jobs)
+
+    def run(self):
+        """ Probe until stop() is called. """
+        self.running = True
+        try:
+            while self.running:
+                if not self.run_once():
+                    time.sleep(self.tick)
+        finally:
+            self.close()
+
+    def close(self):
+        """ Close the database connections of the writers. """
+        probe.close_db(self.db_executor, Settings.PROBE_WRITERS)
+
+    def stop(self):
+        self.running = False
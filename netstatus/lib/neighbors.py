@@ -8,6 +8,7 @@ def probe_switch_neighbors(host, community='public'):
     :param community: if not using default configuration
     :return: empty. Yield will hold our response to StreamingHttpResponse on View
     """
+    switch = None
     try:
         switch = SwitchFactory().factory(host, community)
         neighbors = switch.get_lldp_neighbor(None)
@@ -15,6 +16,9 @@ def probe_switch_neighbors(host, community='public'):
         yield "error connecting to the switch"
         print(repr(e))
         return
+    finally:
+        if switch is not None:
+            switch.close()
 
     yield '# LOCAL: port number + port description  >>  REMOTE: switch name + port + port description'
     for k, v in neighbors.items():
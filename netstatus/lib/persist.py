@@ -0,0 +1,173 @@
+"""
+    Database side of the probe: writes what a Switch instance loaded into the models, with few queries per switch.
+    The callers (probe._switch_status) run these inside one transaction per switch.
+
+    The log tables of snmpswitch-functions.sql keep working: bulk_update() is a plain UPDATE, so the row trigger
+    update_switches_ports still logs each changed port, and the mac_log / mac_log_u rules see every MAC deleted or
+    moved.
+"""
+from collections import Counter
+
+from django.db.models import Q
+from django.utils import timezone
+
+from netstatus.models import SwitchesNeighbors, Mac, SwitchesPorts
+
+# rows per INSERT / UPDATE statement
+BATCH_SIZE = 500
+
+_port_fields = ('speed', 'duplex', 'admin', 'oper', 'lastchange', 'discards_in', 'discards_out', 'oct_in', 'oct_out',
+                'stp_admin', 'stp_state', 'poe_admin', 'poe_detection', 'poe_class', 'poe_mpower', 'mac_count', 'pvid',
+                'port_tagged', 'port_untagged', 'data', 'name', 'alias')
+
+
+def known_ip_mac():
+    """
+    MAC -> IP relation saved by the previous probes, used when the core switch couldn't be loaded in this one.
+    :return: {mac: ip}
+    """
+    return dict(Mac.objects.exclude(ip__isnull=True).exclude(ip='').values_list('mac', 'ip').iterator())
+
+
+def _unique_macs(macs):
+    """
+    macs can appear duplicated due several reasons, like several wifi ports or trunking ports.
+    so, we will create a dict to clean, letting the last entry overwrite the last value.
+    :return: {(mac, vlan): port}
+    """
+    unique = {}
+    for (port, mac, vlan) in macs:
+        unique[(mac, vlan)] = port
+    return unique
+
+
+def count_macs(macs):
+    """
+    Number of MACs of each port, as they are saved by save_macs().
+    :param macs: Switch.macs, ((port, mac, vlan),)
+    :return: {port: count}
+    """
+    return Counter(_unique_macs(macs).values())
+
+
+def save_ports(switch, portas, mac_count=None):
+    """
+    Insert or update the ports of a switch. The existing rows are read in one query.
+    This check is just to avoid deleting ports associate to this switch. Not a big deal, though, but
+    our database should store significant changes onto switches_ports and feed the *_log tables with previous
+    data. Avoiding deleting avoids excessive insert into other table, not for sake of performance, but to maintain
+    these log tables useful to check changes in the network.
+    :param switch: Switches
+    :param portas: Switch.portas
+    :param mac_count: from count_macs(). None keeps the mac_count already stored (when the FDB wasn't loaded).
+    """
+    existing = {sp.port: sp for sp in SwitchesPorts.objects.filter(switch=switch)}
+    data = timezone.now()
+    update = []
+    create = []
+    for port, pdata in portas.items():
+        sp = existing.get(port)
+        if sp is None:
+            sp = SwitchesPorts(switch=switch, port=port, mac_count=0)
+            create.append(sp)
+        else:
+            update.append(sp)
+        sp.speed = pdata['speed']
+        sp.duplex = pdata['duplex']
+        sp.admin = pdata['admin']
+        sp.oper = pdata['oper']
+        sp.lastchange = pdata['lastchange']
+        sp.discards_in = pdata['discards_in']
+        sp.discards_out = pdata['discards_out']
+        sp.oct_in = pdata['oct_in']
+        sp.oct_out = pdata['oct_out']
+        sp.stp_admin = pdata['stp_admin']
+        sp.stp_state = pdata['stp_state']
+        sp.poe_admin = pdata['poe_admin']
+        sp.poe_detection = pdata['poe_detection']
+        sp.poe_class = pdata['poe_class']
+        sp.poe_mpower = pdata['poe_mpower']
+        if mac_count is not None:
+            sp.mac_count = mac_count.get(port, 0)
+        sp.pvid = pdata['pvid']
+        sp.port_tagged = ', '.join(pdata['tagged'])
+        sp.port_untagged = ', '.join(pdata['untagged'])
+        sp.data = data
+        sp.name = pdata['nome'][0:30]
+        sp.alias = pdata['alias'][0:80]
+    SwitchesPorts.objects.bulk_update(update, _port_fields, batch_size=BATCH_SIZE)
+    SwitchesPorts.objects.bulk_create(create, batch_size=BATCH_SIZE)
+
+
+def save_mac_count(switch, mac_count):
+    """
+    Update only the mac_count of the ports of a switch, for loads without the ports (e.g. the 'macs' profile).
+    :param mac_count: from count_macs()
+    """
+    update = []
+    for sp in SwitchesPorts.objects.filter(switch=switch).only('id', 'port', 'mac_count'):
+        if sp.mac_count != mac_count.get(sp.port, 0):
+            sp.mac_count = mac_count.get(sp.port, 0)
+            update.append(sp)
+    SwitchesPorts.objects.bulk_update(update, ('mac_count',), batch_size=BATCH_SIZE)
+
+
+def save_neighbors(switch, obj):
+    """
+    Synchronize the neighbors (LLDP uplinks) of a switch: only the neighbors that disappeared are deleted and only the
+    ones that changed the remote port are updated, so switches_neighbors_log records topology changes, not probes.
+    :param switch: Switches
+    :param obj: Switch instance, after get_lldp_neighbors()
+    """
+    neighbors = {(lport, obj.lldp[lport]['rmac']): obj.lldp[lport]['rport'] for lport in obj.uplink}
+    existing = {(n.port1, n.mac2): n.port2 for n in SwitchesNeighbors.objects.filter(mac1=switch.mac)}
+    gone = Q()
+    for (port1, mac2) in existing.keys() - neighbors.keys():
+        gone |= Q(port1=port1, mac2=mac2)
+    if gone:
+        SwitchesNeighbors.objects.filter(gone, mac1=switch.mac).delete()
+    create = []
+    for (port1, mac2), port2 in neighbors.items():
+        if (port1, mac2) not in existing:
+            create.append(SwitchesNeighbors(mac1=switch.mac, port1=port1, mac2=mac2, port2=port2))
+        elif str(existing[(port1, mac2)]) != str(port2):
+            SwitchesNeighbors.objects.filter(mac1=switch.mac, port1=port1, mac2=mac2).update(port2=port2)
+    SwitchesNeighbors.objects.bulk_create(create, batch_size=BATCH_SIZE)
+
+
+def save_macs(switch, macs, ip_mac=None):
+    """
+    Synchronize the MAC table of a switch with the FDB just loaded, instead of deleting and inserting everything again.
+    Only MACs that disappeared are deleted (and so logged by the mac_log rule). New ones are inserted and the ones
+    which changed port or IP are updated (logged by the mac_log_u rule). The others only get the new date, in one
+    statement by id, so mac.data keeps meaning when the MAC was last seen (a date alone isn't logged by mac_log_u).
+    :param switch: Switches
+    :param macs: Switch.macs, ((port, mac, vlan),)
+    :param ip_mac: {mac: ip} from the core switch. None when there isn't a core switch, keeping the IPs known.
+    """
+    unique = _unique_macs(macs)
+    data = timezone.now()
+    existing = {(m.mac, m.vlan): m for m in Mac.objects.filter(switch=switch).only('id', 'mac', 'vlan', 'port', 'ip')}
+    gone = [m.id for key, m in existing.items() if key not in unique]
+    for i in range(0, len(gone), BATCH_SIZE):
+        Mac.objects.filter(id__in=gone[i:i + BATCH_SIZE]).delete()
+    create = []
+    update = []
+    unchanged = []
+    for (mac, vlan), port in unique.items():
+        m = existing.get((mac, vlan))
+        # '' is the only value for "no IP": None would be seen as a change by the next probe with a core switch
+        ip = ip_mac.get(mac, '') if ip_mac is not None else ''
+        if m is None:
+            create.append(Mac(switch=switch, mac=mac, vlan=vlan, port=port, data=data, ip=ip))
+        elif m.port != port or (ip_mac is not None and m.ip != ip):
+            m.port = port
+            m.ip = ip if ip_mac is not None else m.ip
+            m.data = data
+            update.append(m)
+        else:
+            unchanged.append(m.id)
+    Mac.objects.bulk_update(update, ('port', 'ip', 'data'), batch_size=BATCH_SIZE)
+    for i in range(0, len(unchanged), BATCH_SIZE):
+        Mac.objects.filter(id__in=unchanged[i:i + BATCH_SIZE]).update(data=data)
+    Mac.objects.bulk_create(create, batch_size=BATCH_SIZE)
@@ -1,19 +1,24 @@
+import asyncio
 import logging
 import sys
+import threading
 import time
-from threading import Thread, Lock
 
-from django.db import IntegrityError, DataError, connection
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import IntegrityError, DataError, connection, connections, transaction
 from django.utils import timezone
 
+from netstatus.lib import persist
+from netstatus.lib.devicecache import DeviceCache
+from netstatus.lib.scheduler import ProbeScheduler
+from netstatus.lib.snmp import SnmpFactory
+from netstatus.lib.switch.Switch import Switch
 from netstatus.lib.switchfactory import SwitchFactory
-from netstatus.models import Switches, SwitchesNeighbors, Mac, SwitchesPorts
+from netstatus.models import Switches, SwitchesPorts
 from netstatus.settings import Settings
 
-IP_CORE = ''
-switches_list = {}
-lock = Lock()
-
 
 class ProbeResponse:
     def __init__(self, hosts):
@@ -21,6 +26,14 @@ class ProbeResponse:
         self.hosts = {x[0]: [] for x in hosts}
         self.dryrun = ''
         self.all = []
+        # hosts loaded and given to the writers
+        self.saved = []
+        # MAC -> IP relation of the core switch, when it was loaded
+        self.ip_mac = None
+        # {host: phase} of the switches whose probe was cut by their deadline
+        self.deadlines = {}
+        # hosts not probed, waiting for the end of their back-off
+        self.skipped = []
 
     def add_all(self, msg):
         self.all.append(msg)
@@ -30,6 +43,50 @@ class ProbeResponse:
         self.hosts[host].append(msg)
 
 
+class CoreIndex:
+    """
+    MAC -> IP relation (ARP table) of the core switch, shared by the writers of _switch_status().
+    The mac tables of every switch are joined with it, but the core may be loaded after them. So a writer waits here
+    only while some expected core is still being probed; set() or done() for each of them releases the writers.
+    When no core was loaded, the coroutine function `fallback` gives the relation instead (called once).
+    Used only from the event loop thread.
+    """
+    def __init__(self, hosts, fallback=None):
+        self.pending = set(hosts)
+        self.host = None
+        self.ip_mac = None
+        self.fallback = fallback
+        self._ready = None
+        self._fallback = None
+
+    @property
+    def ready(self):
+        # created inside the running loop (python < 3.10 binds the Event to the loop of its creation)
+        if self._ready is None:
+            self._ready = asyncio.Event()
+            if not self.pending or self.host is not None:
+                self._ready.set()
+        return self._ready
+
+    def set(self, host, ip_mac):
+        self.host = host
+        self.ip_mac = ip_mac
+        self.ready.set()
+
+    def done(self, host):
+        self.pending.discard(host)
+        if not self.pending:
+            self.ready.set()
+
+    async def wait(self):
+        await self.ready.wait()
+        if self.ip_mac is not None or self.fallback is None:
+            return self.ip_mac
+        if self._fallback is None:
+            self._fallback = asyncio.ensure_future(self.fallback())
+        return await self._fallback
+
+
 def now():
     return timezone.now().isoformat()
 
@@ -67,133 +124,245 @@ def inspect_host(host='', community='public', dryrun=True):
     return obj 
 
 
-def probe_update_host(host='', community='public', dryrun=False):
+def probe_update_host(host='', community='public', dryrun=False, profile='full'):
     # one host to be probed and inserted into database
-    rows = [[host, 0, community, -1]]
-    response = _switch_status(rows, dryrun)
+    rows = [[host, 0, community, -1, None, None]]
+    response = _switch_status(rows, dryrun, profile)
     return response
 
 
-def probe_update_db(dryrun=False):
+def probe_update_db(dryrun=False, profile='full', processes=None):
     """
     Fetches all switches from database. This data is sent to _switch_status() to do the job.
     :param dryrun: if True, won't activate the save() after checking the switch.
+    :param profile: load profile (Switch.load_profiles), e.g. 'macs' to refresh only the mac tables.
+    :param processes: split the switches among this number of processes (see _switch_status_sharded).
+    None uses Settings.PROBE_PROCESSES.
     :return:
     """
     try:
-        from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("SELECT ip, stp_root, community_ro, id "
-                       "FROM switches WHERE status = 'active'")
-        rows = cursor.fetchall()
+        rows = active_switches()
     except Exception as e:
         print(e, file=sys.stderr)
         return
     if len(rows) == 0:
         print("Probe_update: Error: no switch to connect to from database", file=sys.stderr)
         return
-    response = _switch_status(rows, dryrun)
+    processes = Settings.PROBE_PROCESSES if processes is None else processes
+    if processes > 1:
+        return _switch_status_sharded(rows, dryrun, profile, processes)
+    response = _switch_status(rows, dryrun, profile)
+    return response
+
+
+def _switch_status_sharded(rows, dryrun, profile, processes):
+    """
+    _switch_status() split among several processes, so the decoding of the SNMP tables and the models aren't bound to
+    one CPU. Each process probes and saves its shard with its own database connection, and sends back only its
+    ProbeResponse.
+    The core switches are probed first, here, and their ARP table is given to the shards. If none of them loads,
+    the shards read the MAC -> IP relation saved in database by the last probes.
+    :param rows: as _switch_status()
+    :return: ProbeResponse of all shards
+    """
+    response = ProbeResponse(rows)
+    response.dryrun = dryrun
+    start = time.perf_counter()
+    cores = [row for row in rows if row[1] == 0]
+    others = [row for row in rows if row[1] != 0]
+    shards = [others[i::processes] for i in range(processes) if others[i::processes]]
+    ip_mac = None
+    if cores:
+        part = _switch_status(cores, dryrun, profile)
+        _merge_response(response, part, 'core')
+        ip_mac = part.ip_mac
+    # the children must not share the connections of this process
+    connections.close_all()
+    try:
+        with ProcessPoolExecutor(max_workers=len(shards) or 1, initializer=_init_process) as pool:
+            futures = [pool.submit(_switch_status_shard, shard, dryrun, profile, ip_mac) for shard in shards]
+            for i, future in enumerate(futures):
+                _merge_response(response, future.result(), 'shard {}'.format(i + 1))
+    except Exception as e:
+        response.add_all('* Error in the probe processes: {}'.format(e))
+    response.add_all("Total of switches {}; Total of Switches Ok: {}; failures: {}; processes: {}".
+                     format(len(rows), len(response.saved), len(rows) - len(response.saved), len(shards)))
+    endtime = time.perf_counter() - start
+    response.add_all("-- *** Execution total time: %5.01f s" % endtime)
+    return response
+
+
+def _switch_status_shard(rows, dryrun, profile, ip_mac):
+    """ _switch_status() of one shard, in a child process. The ARP table isn't sent back: the parent has it. """
+    response = _switch_status(rows, dryrun, profile, ip_mac=ip_mac)
+    response.ip_mac = None
     return response
 
 
-def _switch_status(rows, dryrun):
+def _init_process():
+    # the 'spawn' and 'forkserver' start methods begin with a fresh interpreter
+    import django
+    django.setup()
+
+
+def _merge_response(response, part, name):
+    response.all.extend('{}: {}'.format(name, msg) for msg in part.all)
+    response.hosts.update(part.hosts)
+    response.saved.extend(part.saved)
+    response.deadlines.update(part.deadlines)
+    response.skipped.extend(part.skipped)
+
+
+def active_switches():
+    """
+    :return: the active switches of the database, as the rows of _switch_status()
+    """
+    cursor = connection.cursor()
+    cursor.execute("SELECT ip, stp_root, community_ro, id, snmp_max_repetitions, probe_deadline "
+                   "FROM switches WHERE status = 'active'")
+    return cursor.fetchall()
+
+
+def _switch_status(rows, dryrun, profile='full', cache=None, db_executor=None, ip_mac=None):
     """
     Get and save the data from one or more switches through SNMP into database. Makes conversion from SNMP classes
     to the database model.
-    Receives one or more switches in a tuple with other options. These will be probed in parallel to optimize time and
-    all the data will be placed into Models and save.
-    :param rows: [[ip, stp_root, community, id],...]
+    Receives one or more switches in a tuple with other options. These will be probed concurrently by ProbeScheduler
+    (up to Settings.PROBE_CONCURRENCY at once), and each switch is saved by a writer as soon as it is loaded, while
+    the others are still being probed. Only the switches waiting in the queue are held in memory. The core switches
+    (stp_root = 0 in the last probe) are probed first, because their ARP table is needed to save the mac tables.
+    :param rows: [[ip, stp_root, community, id, snmp_max_repetitions, probe_deadline],...]
     :param dryrun: for testing. Avoid saving into database after every step.
+    :param profile: load profile (Switch.load_profiles). Only the tables refreshed by it are saved.
+    :param cache: DeviceCache kept by the caller across runs. None reads it from Settings.DEVICE_CACHE.
+    :param db_executor: pool of Settings.PROBE_WRITERS threads for the writers, kept by the caller (with its database
+    connections) across runs. None uses a new one, closed at the end.
+    :param ip_mac: MAC -> IP relation of a core switch loaded by another run, used when none of these rows is a core.
     :return: empty string. The main information is yielded for the StreamHttpResponse()
     """
     response = ProbeResponse(rows)
     response.dryrun = dryrun
-    global IP_CORE
-    global switches_list
-    switches_list = {}
-    results = {}
     start = time.perf_counter()
-    # load all host in parallel
-    othreads = []
+    if profile not in Switch.load_profiles:
+        response.add_all('* Error: unknown load profile {}'.format(profile))
+        return response
+    phases = Switch.load_profiles[profile]
+    cache = DeviceCache() if cache is None else cache
+    health = _health(rows)
+    now = timezone.now()
+    # the unreachable switches wait for the end of their back-off, so they don't hold the run up
+    for row in rows:
+        if row[3] in health and health[row[3]][1] and health[row[3]][1] > now:
+            response.skipped.append(row[0])
+            response.add_host_msg(row[0], '* Unreachable {} times: skipped until {}'.format(*health[row[3]]))
+    rows = [row for row in rows if row[0] not in response.skipped]
+    previous = _previous_state(rows) if Settings.PROBE_INCREMENTAL and 'get_ports' in phases else {}
+    _known_classes(rows)
+    # the Django connections are per thread: the writers keep theirs in a small pool of their own
+    own_executor = db_executor is None
+    if own_executor:
+        db_executor = ThreadPoolExecutor(max_workers=Settings.PROBE_WRITERS, thread_name_prefix='probe-db')
+
+    async def known_ip_mac():
+        if ip_mac is not None:
+            return ip_mac
+        try:
+            return await asyncio.get_running_loop().run_in_executor(db_executor, persist.known_ip_mac)
+        except Exception as e:
+            response.add_all('* Error reading the MAC -> IP relation from database: {}'.format(e))
+            return None
+
+    # the switches that were the stp root in the last probe have the ARP table: they go first, as the writers wait
+    # for them before saving mac tables. If none of them loads, the IPs saved by the last probes are used.
+    # The ones that failed the last time go last.
+    rows = sorted(rows, key=lambda row: (row[1] != 0, row[3] in health and health[row[3]][0] > 0))
+    index = CoreIndex([row[0] for row in rows if row[1] == 0], known_ip_mac)
+
+    async def write(obj):
+        try:
+            ip_mac = await index.wait() if obj.loaded('get_mac_list') else None
+            if await asyncio.get_running_loop().run_in_executor(db_executor, _save_switch, obj, response, dryrun,
+                                                                ip_mac):
+                response.saved.append(obj.host)
+        finally:
+            obj.close()
+
     try:
-        for row in rows:
-            results[row[0]] = -1
-            t = Thread(target=_load_host, args=(row[0], row[2], row[3], response))
-            othreads += [t]
-            t.start()
-            time.sleep(0.10)
-        for t in othreads:
-            t.join()
+        ProbeScheduler().run([(_load_host, row[0], row[2], row[3], row[4], response, cache, previous.get(row[3]),
+                               profile, index, row[5], row[3] in health and health[row[3]][0] > 0)
+                              for row in rows], write)
+        if not dryrun:
+            _save_health(rows, health, response.saved, timezone.now())
     except Exception as e:
-        response.add_all('* Error After threads: {}'.format(e))
-
-    s_core = switches_list[IP_CORE] if IP_CORE and IP_CORE in switches_list else None
-    diff = (len(rows) - len(switches_list))
-    # host_problems = [i[0] for i in rows if i[0] not in switches_list] if diff != 0 else []
-
-    response.add_all("Total of switches {}; Total of Switches Ok: {}; failures: {}, core={}".
-                     format(len(rows), len(switches_list), diff, s_core))
-    del othreads
-    for o in switches_list.values():
-        if o is None:
-            response.add_all('-- Switch instance is NoneType. skipping.')
-            continue
-        # some error before the object could exist. Maybe refactor this later
-        if dict is type(o):
-            _host = next(iter(o))
-            response.add_host_msg(_host, o[_host])
-            continue
+        response.add_all('* Error After probing: {}'.format(e))
+    finally:
+        if own_executor:
+            close_db(db_executor, Settings.PROBE_WRITERS)
+    if not dryrun:
+        # a cache that can't be written (e.g. file of another user) only costs a full discovery next time
         try:
-            switch = Switches.objects.get(mac=o.mac)
-        except Switches.DoesNotExist as e:
-            response.add_host_msg(o.host,
-                                  "###### error: switch was not found in database. mac={}".format(o.mac))
-            switch = Switches()
+            cache.save()
+        except OSError as e:
+            logging.warning('DeviceCache: cannot save {}: {}'.format(cache.path, e))
+
+    response.ip_mac = index.ip_mac
+    response.add_all("Total of switches {}; Total of Switches Ok: {}; failures: {}, core={}; in back-off: {}".
+                     format(len(rows), len(response.saved), len(rows) - len(response.saved), index.host,
+                            len(response.skipped)))
+    for host, phase in response.deadlines.items():
+        response.add_all('* Deadline exceeded: {} in {}'.format(host, phase))
+    endtime = time.perf_counter() - start
+    response.add_all("-- *** Execution total time: %5.01f s" % endtime)
+    return response
 
-        response.add_host_msg(
-            o.host,
-            'Basic data from switch: ID={}, serial_number={}, name={}, alias={}, mac={}, ip="{}", vendor={}, '
-            'class={}, len(ports)={}, stp_root={}'.format(
-             switch.id, switch.serial_number, switch.name, switch.alias, switch.mac, o.host, o.vendor,
-             o.__class__.__name__, len(o.portas), o.stp))
-        # the switch should be unique in the database, based on mac / serial_number.
-        # But it may be relocated and have name and IP changed. So, apply those changes to the database.
-        switch.name          = o.name
-        switch.mac           = o.mac
-        switch.ip            = o.host
-        switch.model         = o.model
-        switch.serial_number = o.serial
-        switch.status        = 'active'
-        switch.vendor        = o.vendor
-        switch.soft_version  = o.soft_version
-        switch.stp_root      = o.stp
-        switch.community_ro  = o.comunidade
-        switch.uptime        = o.uptime
 
-        try:
-            switch.alias = Settings.SWITCH_ALIAS(o.name) if Settings.SWITCH_ALIAS else o.name[:6]
-        except TypeError:
-            switch.alias = o.name[:6]
+def _save_switch(o, response, dryrun, ip_mac=None):
+    """
+    Save one loaded switch into database, in one transaction. Runs in a writer thread of _switch_status().
+    :param o: Switch, loaded with some profile. Only the tables refreshed by it are saved.
+    :param response: ProbeResponse
+    :param dryrun: only report the switch, without saving it
+    :param ip_mac: MAC -> IP relation of the core switch, for the mac table. None keeps the IPs in database.
+    :return: False when the switch couldn't be saved (the error is in the host messages)
+    """
+    try:
+        switch = Switches.objects.get(mac=o.mac)
+    except Switches.DoesNotExist as e:
+        response.add_host_msg(o.host,
+                              "###### error: switch was not found in database. mac={}".format(o.mac))
+        switch = Switches()
+
+    response.add_host_msg(
+        o.host,
+        'Basic data from switch: ID={}, serial_number={}, name={}, alias={}, mac={}, ip="{}", vendor={}, '
+        'class={}, len(ports)={}, stp_root={}'.format(
+         switch.id, switch.serial_number, switch.name, switch.alias, switch.mac, o.host, o.vendor,
+         o.__class__.__name__, len(o.portas), o.stp))
+    # the switch should be unique in the database, based on mac / serial_number.
+    # But it may be relocated and have name and IP changed. So, apply those changes to the database.
+    switch.name          = o.name
+    switch.mac           = o.mac
+    switch.ip            = o.host
+    switch.model         = o.model
+    switch.serial_number = o.serial
+    switch.status        = 'active'
+    switch.vendor        = o.vendor
+    switch.soft_version  = o.soft_version
+    switch.stp_root      = o.stp
+    switch.community_ro  = o.comunidade
+    switch.uptime        = o.uptime
+    switch.sys_object_id = o.object_id
+    switch.sys_descr     = o.descr
+    switch.switch_class  = o.__class__.__name__
+    if o.loaded('get_ports') and not o.ports_incremental:
+        switch.ports_full_load = timezone.now()
 
-        if not dryrun:
-            try:
-                switch.save()
-                cursor = connection.cursor()
-                cursor.execute("UPDATE switches SET status='inactive_script' "
-                               "WHERE status='active' AND ip='{0}' and serial_number <> '{1}'".\
-                               format(switch.ip, switch.serial_number))
-            except DataError as e:
-                response.add_host_msg(o.host, "* Error saving switch {} ({}): {}".format(switch.id, switch.name, e))
-                response.add_host_msg(o.host, connection.queries[-1])
-                continue
-            except IntegrityError as e:
-                response.add_host_msg(o.host,
-                                      "Switch already is present in database but not found when you looked for it.\n"
-                                      "{}\n id={}, mac={}, mac2={}".
-                                      format(e,  switch.id, switch.mac, o.mac))
-                response.add_host_msg(o.host, connection.queries[-3:])
-                continue
+    try:
+        switch.alias = Settings.SWITCH_ALIAS(o.name) if Settings.SWITCH_ALIAS else o.name[:6]
+    except TypeError:
+        switch.alias = o.name[:6]
 
+    if o.loaded('get_ports') and 1 in o.portas:
         sp = o.portas[1]
         response.add_host_msg(
             o.host,
@@ -202,140 +371,237 @@ def _switch_status(rows, dryrun):
              1, sp['nome'][:30], sp['speed'], sp['admin'], sp['oper'], sp['stp_admin'], sp['poe_admin'],
              sp['poe_mpower'], sp['pvid'], ', '.join(sp['tagged']), ', '.join(sp['untagged']))
             )
-        # this check is just to avoid deleting ports associate to this switch. Not a big deal, though, but
-        # our database should store significant changes onto switches_ports and feed the *_log tables with previous
-        # data. Avoiding deleting avoids excessive insert into other table, not for sake of performance, but to maintain
-        # these log tables useful to check changes in the network.
-        for port, pdata in o.portas.items():
-            try:
-                sp = SwitchesPorts.objects.get(switch=switch, port=port)
-            except SwitchesPorts.DoesNotExist as e:
-                sp = SwitchesPorts()
-            sp.switch = switch
-            sp.port = port
-            sp.speed = pdata['speed']
-            sp.duplex = pdata['duplex']
-            sp.admin = pdata['admin']
-            sp.oper = pdata['oper']
-            sp.lastchange = pdata['lastchange']
-            sp.discards_in = pdata['discards_in']
-            sp.discards_out = pdata['discards_out']
-            sp.oct_in = pdata['oct_in']
-            sp.oct_out = pdata['oct_out']
-            sp.stp_admin = pdata['stp_admin']
-            sp.stp_state = pdata['stp_state']
-            sp.poe_admin = pdata['poe_admin']
-            sp.poe_detection = pdata['poe_detection']
-            sp.poe_class = pdata['poe_class']
-            sp.poe_mpower = pdata['poe_mpower']
-            sp.mac_count = 0
-            sp.pvid = pdata['pvid']
-            sp.port_tagged = ', '.join(pdata['tagged'])
-            sp.port_untagged = ', '.join(pdata['untagged'])
-            sp.data = now()
-            sp.name = pdata['nome'][0:30]
-            sp.alias = pdata['alias'][0:80]
-            if not dryrun:
-                try:
-                    sp.save()
-                except IntegrityError as e:
-                    response.add_host_msg(o.host,
-                                          "* Error saving port {}: {}".format(sp.port, e))
-
-        SwitchesNeighbors.objects.filter(mac1=switch.mac).delete()
-        for lport in o.uplink:
-            # omac, oport = o.lldp[lport]
-            omac = o.lldp[lport]['rmac']
-            oport = o.lldp[lport]['rport']
-            sn = SwitchesNeighbors(mac1=switch.mac, port1=lport, mac2=omac, port2=oport)
-            if not dryrun:
-                try:
-                    sn.save()
-                except IntegrityError as e:
-                    response.add_host_msg(o.host,
-                                          "* Error saving neighbor :: (omac, oport) = ({}, {})".format(omac, oport))
-
-        # macs can appear duplicated due several reasons, like several wifi ports or trunking ports.
-        # so, we will create a dict to clean, letting the last entry overwrite the last value.
-        macs = {}
-        for (port, mac, vlan) in o.macs:
-            macs[(switch.id, mac, vlan)] = port
-        Mac.objects.filter(switch=switch).delete()
-        for (_, mac, vlan), port in macs.items():
-            # m = Mac(switch=switch, mac=mac, vlan=vlan, port=port, data=datetime.now())
-            m = Mac(switch=switch, mac=mac, vlan=vlan, port=port, data=now())
-            if s_core:
-                m.ip = s_core.ip_mac[mac] if mac in s_core.ip_mac else ''
-            if not dryrun:
-                try:
-                    m.save()
-                except Exception as e:
-                    response.add_host_msg(o.host, "#>>> error saving mac: {}".format(e))
-
-    # updating the mac_count field in SwitchesPorts is much easier through database.
-    if not dryrun:
-        with connection.cursor() as cursor:
-            cursor.execute("UPDATE switches_ports SET mac_count=(select count(*) from mac where "
-                           "mac.switch=switches_ports.switch and mac.port=switches_ports.port)")
-    endtime = time.perf_counter() - start
-    response.add_all("-- *** Execution total time: %5.01f s" % endtime)
-    del switches_list
-    return response
+    if dryrun:
+        return True
+    # one transaction per switch: all of its tables are saved, or nothing is.
+    try:
+        with transaction.atomic():
+            switch.save()
+            cursor = connection.cursor()
+            cursor.execute("UPDATE switches SET status='inactive_script' "
+                           "WHERE status='active' AND ip='{0}' and serial_number <> '{1}'".\
+                           format(switch.ip, switch.serial_number))
+            mac_count = persist.count_macs(o.macs) if o.loaded('get_mac_list') else None
+            if o.loaded('get_ports'):
+                persist.save_ports(switch, o.portas, mac_count)
+            elif mac_count is not None:
+                persist.save_mac_count(switch, mac_count)
+            if o.loaded('get_lldp_neighbors'):
+                persist.save_neighbors(switch, o)
+            if o.loaded('get_mac_list'):
+                persist.save_macs(switch, o.macs, ip_mac)
+    except DataError as e:
+        response.add_host_msg(o.host, "* Error saving switch {} ({}): {}".format(switch.id, switch.name, e))
+        response.add_host_msg(o.host, connection.queries[-1:])
+        return False
+    except IntegrityError as e:
+        response.add_host_msg(o.host,
+                              "* Error saving switch {} ({}), nothing was saved. Maybe it is already present in "
+                              "database but not found when you looked for it.\n{}\n id={}, mac={}, mac2={}".
+                              format(switch.id, switch.name, e, switch.id, switch.mac, o.mac))
+        response.add_host_msg(o.host, connection.queries[-3:])
+        return False
+    return True
+
+
+def on_db_workers(executor, workers, func):
+    """
+    Run func once in every thread of the writers pool, e.g. to close their database connections, and wait for it.
+    Each thread waits at the barrier, so every worker runs exactly one of the jobs.
+    """
+    barrier = threading.Barrier(workers)
+
+    def job():
+        barrier.wait()
+        func()
+
+    for future in [executor.submit(job) for _ in range(workers)]:
+        future.result()
+
+
+def close_db(executor, workers):
+    """ Close the database connection of every thread of the writers pool, then the pool itself. """
+    on_db_workers(executor, workers, connections.close_all)
+    executor.shutdown(wait=True)
+
+
+def _health(rows):
+    """
+    :param rows: as _switch_status()
+    :return: {switch id: (consecutive failures, next attempt or None)}
+    """
+    ids = [row[3] for row in rows if row[3] != -1]
+    return {switchid: (failures, next_attempt) for switchid, failures, next_attempt in
+            Switches.objects.filter(id__in=ids).values_list('id', 'probe_failures', 'probe_next_attempt')}
+
+
+def _known_classes(rows):
+    """
+    Seed the classification cache of SwitchFactory with the classes saved by the last probes of these switches, so
+    they are built with them without going through SwitchFactory._type().
+    :param rows: as _switch_status()
+    """
+    ids = [row[3] for row in rows if row[3] != -1]
+    for object_id, descr, name in Switches.objects.filter(id__in=ids, switch_class__isnull=False).\
+            values_list('sys_object_id', 'sys_descr', 'switch_class'):
+        SwitchFactory.classified.put(object_id, descr or '', name)
 
 
-def _load_host(host, community, switchid, response):
+def backoff(failures):
+    """
+    :param failures: consecutive failures, counting the last one
+    :return: seconds until the next attempt, doubled after every failure up to Settings.PROBE_BACKOFF_MAX
+    """
+    return min(Settings.PROBE_BACKOFF * 2 ** (failures - 1), Settings.PROBE_BACKOFF_MAX)
+
+
+def _save_health(rows, health, saved, now):
+    """
+    Save the health of the probed switches: the ones loaded are healthy again, and the others go to back-off.
+    :param health: as _health(), before this probe
+    :param saved: hosts loaded
+    """
+    ok = [row[3] for row in rows if row[0] in saved and row[3] in health]
+    Switches.objects.filter(id__in=ok).update(probe_failures=0, probe_last_success=now, probe_next_attempt=None)
+    for row in rows:
+        if row[0] in saved or row[3] not in health:
+            continue
+        failures = health[row[3]][0] + 1
+        Switches.objects.filter(id=row[3]).update(
+            probe_failures=failures, probe_next_attempt=now + timedelta(seconds=backoff(failures)))
+
+
+def _alive(host, community):
+    """
+    Liveness check of a switch that failed the last probe: one GET of sysUpTime, with a short timeout and no retries.
+    :return: True if it answered (any answer, even noSuchObject)
+    """
+    sessao = SnmpFactory.factory(host, community)
+    sessao.timeout = Settings.PROBE_LIVENESS_TIMEOUT
+    sessao.retries = 0
+    try:
+        sessao.start()
+        sessao.get(['.1.3.6.1.2.1.1.3.0'])
+        return True
+    except Exception:
+        return False
+    finally:
+        sessao.close()
+
+
+def _previous_state(rows):
+    """
+    Ports and uptime of each switch from the last probe, used by the incremental Switch.get_ports().
+    Read here, before the probe starts, so the concurrent part doesn't touch the database.
+    The switches whose ports weren't fully loaded in the last Settings.PROBE_FULL_LOAD_AGE seconds are left out, so
+    they are fully loaded again.
+    :param rows: as _switch_status()
+    :return: {switch id: (uptime in milliseconds, {port: dictionary as Switch.portas})}
+    """
+    ids = [row[3] for row in rows if row[3] != -1]
+    recent = timezone.now() - timedelta(seconds=Settings.PROBE_FULL_LOAD_AGE)
+    uptimes = {}
+    for switchid, uptime in Switches.objects.filter(id__in=ids, ports_full_load__gte=recent).\
+            values_list('id', 'uptime'):
+        uptimes[switchid] = uptime.total_seconds() * 1000 if hasattr(uptime, 'total_seconds') else float(uptime)
+    ports = {}
+    for p in SwitchesPorts.objects.filter(switch_id__in=uptimes.keys()):
+        ports.setdefault(p.switch_id, {})[p.port] = {
+            'speed': p.speed, 'duplex': p.duplex, 'admin': p.admin, 'oper': p.oper, 'lastchange': p.lastchange,
+            'discards_in': p.discards_in, 'discards_out': p.discards_out, 'oct_in': p.oct_in, 'oct_out': p.oct_out,
+            'stp_admin': p.stp_admin, 'stp_state': p.stp_state, 'poe_admin': p.poe_admin,
+            'poe_detection': p.poe_detection, 'poe_class': p.poe_class, 'poe_mpower': p.poe_mpower, 'mac_count': 0,
+            'pvid': str(p.pvid), 'tagged': p.port_tagged.split(', ') if p.port_tagged else [],
+            'untagged': p.port_untagged.split(', ') if p.port_untagged else [], 'nome': p.name, 'alias': p.alias,
+        }
+    return {switchid: (uptime, ports[switchid]) for switchid, uptime in uptimes.items() if switchid in ports}
+
+
+async def _load_host(executor, host, community, switchid, max_repetitions, response, cache=None, previous=None,
+                     profile='full', index=None, deadline=None, failing=False):
     """
     Obtain all data from a switch through SNMP.
-    Small piece of code used to parallelize switches probes called by Thread class
+    Coroutine run by ProbeScheduler, one per switch. Every blocking SNMP call goes to the executor, while the
+    results are stored from the event loop thread, so no lock is needed around the cache or the index.
+    :param executor: executor for the blocking SNMP calls, given by ProbeScheduler
     :param host: hostname / IP (mainly last one) of the switch
     :param community: the community used by this host
     :param switchid: id from database. -1 if nonexistent
-    :return: integer value with status. 3=ok, 2 and 1 are problems. Not really used.
+    :param max_repetitions: GETBULK max-repetitions for this switch. None keeps the class / Settings default.
+    :param cache: DeviceCache shared by all switches of this run. Updated from the event loop thread as well.
+    :param previous: (uptime, ports) from _previous_state(), for the incremental load. None loads everything.
+    :param profile: load profile, see Switch.load_profiles
+    :param index: CoreIndex of this run. Receives the ip_mac of the core switch, and is told when this host is done.
+    :param deadline: seconds given to this switch. None uses Settings.PROBE_DEADLINE; 0 means no limit.
+    When they run out, the probe is cancelled (including the SNMP session, in the executor) and nothing is saved.
+    :param failing: the last probe of this switch failed. It is probed only if it passes a liveness check (_alive).
+    :return: the loaded Switch, given to the writers of _switch_status(). None if there were problems.
     """
-    global switches_list
-    global IP_CORE
-    global lock
+    deadline = Settings.PROBE_DEADLINE if deadline is None else deadline
+    current = {}
+    obj = None
+    try:
+        obj = await asyncio.wait_for(_load_switch(executor, host, community, switchid, max_repetitions, response,
+                                                  cache, previous, profile, index, deadline, current, failing),
+                                     deadline if deadline else None)
+    except asyncio.TimeoutError:
+        phase = current['switch'].phase if 'switch' in current and current['switch'].phase else 'factory'
+        if 'switch' in current:
+            current['switch'].sessao.cancel()
+        response.deadlines[host] = phase
+        response.add_host_msg(host, "* Deadline of {} s exceeded in {}. Nothing was saved.".format(deadline, phase))
+    finally:
+        if index is not None:
+            index.done(host)
+        # the writers close the switches they receive; the others are closed here
+        if obj is None and 'switch' in current:
+            current['switch'].close()
+    return obj
+
+
+async def _load_switch(executor, host, community, switchid, max_repetitions, response, cache, previous, profile,
+                       index, deadline, current, failing):
     start1 = time.perf_counter()
+    if failing and not await asyncio.get_running_loop().run_in_executor(executor, _alive, host, community):
+        response.add_host_msg(host, "* No answer to the liveness check")
+        return None
     try:
-        obj = SwitchFactory().factory(host, community)
+        obj = await SwitchFactory.factory_async(host, community, executor=executor, cache=cache)
     except Exception as e:
         response.add_host_msg(host, "Error with switch: " + str(e))
-        """
-        if not lock.acquire(timeout=30):
-            response.("% host {} was locked out and couldn't be inserted back into list. ".format(host))
-            lock.release()
-            return 3
-        switches_list[host] = obj
-        lock.release()
-        """
-        return 4
+        return None
 
     if not obj:
-        return 1
+        return None
+    current['switch'] = obj
+    if deadline:
+        # the executor thread stops by itself as well, just after the wait_for() of _load_host() (which reports it)
+        obj.sessao.deadline = time.monotonic() + deadline + 1 - (time.perf_counter() - start1)
     obj.id = switchid
+    if max_repetitions is not None:
+        obj.sessao.max_repetitions = max_repetitions
+    if previous is not None:
+        obj.set_previous(*previous)
     try:
-        obj.load()
+        await obj.load_async(executor, profile)
     except Exception as e:
         import traceback
         response.add_host_msg(host, "Got exception in loading data: {}\n----- Trace: {}".
                               format(e, traceback.print_exc()))
-        return 2
+        return None
+    if cache is not None:
+        cache.put(obj.mac, obj.cache_entry())
     try:
         # if stp_root (main / sole switch), then try to get the IP-MAC relation
         if obj.stp == 0:
-            obj.get_ip_mac()
-            IP_CORE = host
+            obj.phase = 'get_ip_mac'
+            await asyncio.get_running_loop().run_in_executor(executor, obj.get_ip_mac)
+            if index is not None:
+                index.set(host, obj.ip_mac)
             response.add_host_msg(host, 'Core / sole switch')
         response.add_host_msg(host, "Load time: %3.01f s" % (time.perf_counter() - start1))
     except Exception as e:
         response.add_host_msg(host,
                               "Error when processing IP info: {}".format(host, e))
-        return 2
-
-    if not lock.acquire(timeout=30):
-        response.add_all("host {} was locked out and couldn't be inserted back into list. ".format(host))
-        lock.release()
-        return 3
-    switches_list[host] = obj
-    lock.release()
-    return 0
+        return None
+    return obj
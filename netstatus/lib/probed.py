@@ -0,0 +1,100 @@
+"""
+    Long running probe (manage.py probed), instead of calling /probe/updatedb from cron.
+    Each active switch is probed again after the interval of each load profile (Settings.PROBED_INTERVALS), varied by
+    a random jitter, so the switches and the database receive a steady flow of small runs instead of one burst.
+    The device cache and the database connections of the writers are kept from one run to the next.
+"""
+import heapq
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections
+
+from netstatus.lib import probe
+from netstatus.lib.devicecache import DeviceCache
+from netstatus.settings import Settings
+
+
+class ProbeDaemon:
+    # longest sleep between two checks of the queue, in seconds
+    tick = 5
+
+    def __init__(self, intervals=None, jitter=None, dryrun=False, output=None):
+        """
+        :param intervals: {load profile: seconds}. None uses Settings.PROBED_INTERVALS.
+        :param jitter: percent of each interval randomly added or removed. None uses Settings.PROBED_JITTER.
+        :param dryrun: don't save into the database
+        :param output: called with (profile, ProbeResponse) after each run
+        """
+        intervals = Settings.PROBED_INTERVALS if intervals is None else intervals
+        self.intervals = {profile: interval for profile, interval in intervals.items() if interval}
+        self.jitter = Settings.PROBED_JITTER if jitter is None else jitter
+        self.dryrun = dryrun
+        self.output = output
+        self.running = False
+        # heap of (due time, priority, host, profile). The core switches (priority False) go first.
+        self.queue = []
+        self.rows = {}
+        self.refreshed = None
+        self.cache = DeviceCache()
+        self.db_executor = ThreadPoolExecutor(max_workers=Settings.PROBE_WRITERS, thread_name_prefix='probe-db')
+
+    def _due(self, profile, now, first=False):
+        interval = self.intervals[profile]
+        if first:
+            # spread the first probes along the whole interval
+            return now + random.uniform(0, interval)
+        return now + interval * random.uniform(1 - self.jitter / 100, 1 + self.jitter / 100)
+
+    def refresh(self, now):
+        """
+        Read the active switches again. The new ones are scheduled; the ones removed are dropped when they are due.
+        """
+        close_old_connections()
+        rows = {row[0]: row for row in probe.active_switches()}
+        for host in rows.keys() - self.rows.keys():
+            for profile in self.intervals:
+                heapq.heappush(self.queue, (self._due(profile, now, first=True), rows[host][1] != 0, host, profile))
+        self.rows = rows
+        self.refreshed = now
+
+    def pop_due(self, now):
+        """
+        Take out the switches due until now, scheduling their next probe.
+        :return: {profile: [row, ...]}
+        """
+        batches = {}
+        while self.queue and self.queue[0][0] <= now:
+            _, _, host, profile = heapq.heappop(self.queue)
+            row = self.rows.get(host)
+            if row is None:
+                continue
+            batches.setdefault(profile, []).append(row)
+            heapq.heappush(self.queue, (self._due(profile, now), row[1] != 0, host, profile))
+        return batches
+
+    def run_once(self, now=None):
+        """ Probe the switches due now, one run per load profile. """
+        now = time.time() if now is None else now
+        if self.refreshed is None or now - self.refreshed >= Settings.PROBED_REFRESH:
+            self.refresh(now)
+        for profile, rows in self.pop_due(now).items():
+            probe.on_db_workers(self.db_executor, Settings.PROBE_WRITERS, close_old_connections)
+            response = probe._switch_status(rows, self.dryrun, profile, self.cache, self.db_executor)
+            if self.output:
+                self.output(profile, response)
+
+    def run(self):
+        """ Probe until stop() is called. """
+        self.running = True
+        try:
+            while self.running:
+                self.run_once()
+                wait = self.queue[0][0] - time.time() if self.queue else self.tick
+                time.sleep(min(max(wait, 0), self.tick))
+        finally:
+            probe.close_db(self.db_executor, Settings.PROBE_WRITERS)
+
+    def stop(self):
+        self.running = False
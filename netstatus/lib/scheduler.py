@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from netstatus.settings import Settings
+
+
+class ProbeScheduler:
+    """
+    Drives the probe of several switches from one asyncio event loop, keeping at most `concurrency` of them in
+    flight at the same time.
+    netsnmp-py only has blocking calls, so the SNMP work itself goes to a thread pool with the same size as the
+    concurrency limit; the event loop only coordinates the jobs. The run time is then bound to the network round
+    trips of the slowest switches instead of one thread per switch.
+
+    A job is a tuple (coroutine function, arg1, arg2, ...). The coroutine is called as func(executor, arg1, ...)
+    and must use the given executor for any blocking call.
+
+    With a consumer, run() works as a pipeline: the result of each job (when not None) goes to a bounded queue,
+    and `writers` tasks pass them to the consumer as soon as they arrive. A job waits for room in the queue after
+    releasing its concurrency slot, so slow consumers hold back new results, not the jobs already in flight.
+    """
+    def __init__(self, concurrency=None, writers=None, queue_size=None):
+        self.concurrency = concurrency if concurrency else Settings.PROBE_CONCURRENCY
+        self.writers = writers if writers else Settings.PROBE_WRITERS
+        self.queue_size = queue_size if queue_size else Settings.PROBE_QUEUE_SIZE
+
+    async def _run_job(self, semaphore, executor, queue, func, args):
+        async with semaphore:
+            result = await func(executor, *args)
+        if queue is None:
+            return result
+        # the result belongs to the consumer now: don't keep it in the gather() list
+        if result is not None:
+            await queue.put(result)
+
+    async def _consume(self, queue, consumer):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            try:
+                await consumer(item)
+            except Exception as e:
+                # a dead writer would leave the queue full and the jobs waiting forever
+                logging.error('ProbeScheduler: consumer failed: {}'.format(e))
+
+    async def _run(self, jobs, consumer):
+        semaphore = asyncio.Semaphore(self.concurrency)
+        queue = asyncio.Queue(self.queue_size) if consumer else None
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='probe') as executor:
+            writers = [asyncio.ensure_future(self._consume(queue, consumer)) for _ in range(self.writers)] \
+                if consumer else []
+            results = await asyncio.gather(*(self._run_job(semaphore, executor, queue, func, args)
+                                             for func, *args in jobs), return_exceptions=True)
+            for _ in writers:
+                await queue.put(None)
+            await asyncio.gather(*writers)
+            return results
+
+    def run(self, jobs, consumer=None):
+        """
+        Run all jobs and wait for them.
+        :param jobs: [(coroutine function, arg1, ...), ...]
+        :param consumer: optional coroutine function called with the result of each job, as soon as it finishes.
+        :return: list with the result of each job, in the same order. Exceptions are returned, not raised. With a
+        consumer, the results were already given to it and the list holds only the exceptions (or None).
+        """
+        return asyncio.run(self._run(jobs, consumer))
@@ -1,8 +1,26 @@
 from datetime import timedelta
+import asyncio
+import bisect
+import io
 import os
+import threading
+import time
 
-import netsnmp
-from netsnmp._api import SNMPError
+from netstatus.settings import Settings
+
+# positions in each (oid, type, value) answer
+OID, TYPE, VALUE = 0, 1, 2
+
+# netsnmp-py, imported by the first session (see SNMP.start()): who never talks SNMP doesn't load it
+netsnmp = None
+
+
+class SNMPError(Exception):
+    """ Error of an SNMP request (timeout, unknown host, ...), as raised by the netsnmp library. """
+
+
+class SNMPCancelled(Exception):
+    """ The session was cancelled, or its deadline passed, before a request. """
 
 
 class SnmpFactory:
@@ -11,7 +29,9 @@ class SnmpFactory:
     like PseudoSNMP or using Mock
     """
     @classmethod
-    def factory(cls, host='', community='public', version=2):
+    def factory(cls, host='', community='public', version=2, asynchronous=False):
+        if asynchronous:
+            return AsyncSNMP(host, community, version)
         return SNMP(host, community, version)
 
 
@@ -25,36 +45,293 @@ class SNMP:
     version = 2
     community = 'public'
     session = None
+    # rows asked by each GETBULK request in walk(). 0 = GETNEXT walk.
+    max_repetitions = Settings.SNMP_MAX_REPETITIONS
+    # OIDs per GET PDU. Learned per device: halved when the agent can't answer a PDU (see get()). SessionPool starts
+    # it again from Settings.SNMP_MAX_VARBINDS when the session is acquired for a new probe.
+    max_varbinds = Settings.SNMP_MAX_VARBINDS
     _map = {1: '1', 2: '2c', 3: '3'}
+    _end_types = ('NOSUCHINSTANCE', 'NOSUCHOBJECT', 'ENDOFMIBVIEW')
+    # error messages meaning the PDU was too big for the agent, not that an OID is wrong
+    _pdu_errors = ('toobig', 'too big', 'too large')
+    # genErr may be the PDU size as well, but also one OID the agent fails to answer
+    _generr_errors = ('generr', 'general failure')
+    # time.monotonic() after which no request is sent (SNMPCancelled is raised instead). None = no deadline.
+    deadline = None
+    cancelled = False
+    # netsnmp timeout (seconds) and retries of each request. None keeps the netsnmp defaults.
+    timeout = None
+    retries = None
 
     def __init__(self, host, community='public', version=2):
         self.community = community
         self.version = self._map[version]
         # IPv6 needs to be explicit, it won't guess based on IP
         self.host = 'udp6:[{}]'.format(host) if ':' in host else host
+        # sessions of SessionPool may be shared by several threads: one request at a time
+        self._lock = threading.Lock()
 
     def start(self):
+        global netsnmp
+        if netsnmp is None:
+            import netsnmp._api
         try:
-            self.session = netsnmp.SNMPSession(self.host, self.community)
-        except SNMPError as e:
-            raise e
+            options = {name: getattr(self, name) for name in ('timeout', 'retries') if getattr(self, name) is not None}
+            self.session = netsnmp.SNMPSession(self.host, self.community, **options)
+        except netsnmp._api.SNMPError as e:
+            raise SNMPError(*e.args) from e
+
+    def _request(self, method, *args):
+        """ One request through the netsnmp session, with its errors as SNMPError. """
+        with self._lock:
+            try:
+                return getattr(self.session, method)(*args)
+            except netsnmp._api.SNMPError as e:
+                raise SNMPError(*e.args) from e
+
+    def cancel(self):
+        """
+        Stop this session: the next request raises SNMPCancelled. Called from another thread, it ends a long walk in
+        the next round trip, as a request already sent can't be interrupted.
+        """
+        self.cancelled = True
+
+    def _check(self):
+        if self.cancelled:
+            raise SNMPCancelled('session cancelled')
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise SNMPCancelled('deadline exceeded')
 
     def get(self, oids_var):
-        return self.session.get(oids_var)
+        """
+        GET any number of OIDs. They are packed into PDUs of up to max_varbinds OIDs. When the agent answers tooBig,
+        the PDU is split in half and asked again, and the smaller size is kept for the next requests. A genErr PDU is
+        asked again in halves as well, but the smaller size is only kept when the halves are answered: a genErr of a
+        single OID is raised and doesn't change max_varbinds.
+        :param oids_var: OID or list of OIDs
+        :return: [(oid, type, value), ...] in the same order of oids_var
+        """
+        self._check()
+        if isinstance(oids_var, str):
+            return self._get(oids_var)
+        oids_var = list(oids_var)
+        ret = []
+        pos = 0
+        while pos < len(oids_var):
+            self._check()
+            pdu = oids_var[pos:pos + self.max_varbinds]
+            try:
+                ret += self._get(pdu)
+            except SNMPError as e:
+                if len(pdu) == 1 or not (self._is_pdu_error(e) or self._is_generr(e)):
+                    raise
+                if self._is_pdu_error(e):
+                    self.max_varbinds = len(pdu) // 2
+                    continue
+                ret += self._get_halves(pdu)
+                self.max_varbinds = len(pdu) // 2
+            pos += len(pdu)
+        return ret
+
+    def _get_halves(self, pdu):
+        """ GET a PDU answered with genErr, split in halves until each part is answered or a single OID fails. """
+        half = len(pdu) // 2
+        ret = []
+        for part in (pdu[:half], pdu[half:]):
+            try:
+                ret += self._get(part)
+            except SNMPError as e:
+                if len(part) == 1 or not (self._is_pdu_error(e) or self._is_generr(e)):
+                    raise
+                ret += self._get_halves(part)
+        return ret
+
+    def _get(self, oids_var):
+        """ One GET PDU. """
+        return self._request('get', oids_var)
+
+    def _is_pdu_error(self, error):
+        message = str(error).lower()
+        return any(e in message for e in self._pdu_errors)
+
+    def _is_generr(self, error):
+        message = str(error).lower()
+        return any(e in message for e in self._generr_errors)
 
     def getnext(self, oids_var):
-        return self.session.getnext(oids_var)
+        self._check()
+        return self._request('getnext', oids_var)
+
+    def getbulk(self, oids_var, non_repeaters=0, max_repetitions=10):
+        self._check()
+        return self._request('getbulk', oids_var, non_repeaters, max_repetitions)
 
     def walk(self, oids_var):
-        return self.session.walk(oids_var)
+        """
+        Walk one or more subtrees. SNMPv2c sessions use GETBULK (see bulkwalk()) unless max_repetitions is 0.
+        """
+        self._check()
+        if self.version == '1' or not self.max_repetitions:
+            return self._request('walk', oids_var)
+        return self.bulkwalk(oids_var)
+
+    def iwalk(self, oids_var):
+        """
+        walk() as a generator. With GETBULK the rows are handed over as each answer arrives, so big tables (FDB, ARP)
+        are consumed without keeping the whole walk in memory.
+        """
+        self._check()
+        if self.version == '1' or not self.max_repetitions:
+            return iter(self._request('walk', oids_var))
+        return self._ibulkwalk(oids_var, self.max_repetitions)
+
+    def bulkwalk(self, oids_var, max_repetitions=None):
+        """
+        Walk through GETBULK requests. Each request brings up to max_repetitions rows, instead of one GETNEXT
+        round-trip per row, which makes a big difference on FDB and ARP tables of core switches.
+        :param oids_var: OID or list of OIDs (subtree roots)
+        :param max_repetitions: rows per request. Defaults to self.max_repetitions
+        :return: [(oid, type, value), ...], as walk()
+        """
+        return list(self._ibulkwalk(oids_var, max_repetitions if max_repetitions else self.max_repetitions))
+
+    def _ibulkwalk(self, oids_var, max_repetitions):
+        if isinstance(oids_var, str):
+            oids_var = [oids_var]
+        for root in oids_var:
+            yield from self._bulkwalk_subtree(root, max_repetitions)
+
+    def _bulkwalk_subtree(self, root, max_repetitions):
+        prefix = root.strip('.') + '.'
+        last = root
+        while True:
+            self._check()
+            rows = self.getbulk(last, 0, max_repetitions)
+            for row in rows:
+                if not row[OID].lstrip('.').startswith(prefix) or row[TYPE] in self._end_types:
+                    return
+                yield row
+            # an empty answer or an agent going backwards would loop forever
+            if not rows or rows[-1][OID] == last:
+                return
+            last = rows[-1][OID]
 
     # type_var must be one of several letters provided by snmpset -h
     def set(self, oids_var, value, type_var):
-        return self.session.set(oids_var, value, type_var)
+        self._check()
+        return self._request('set', oids_var, value, type_var)
 
-    def __del__(self):
+    def close(self):
         if self.session:
             self.session.close()
+            self.session = None
+
+    def __del__(self):
+        self.close()
+
+
+class AsyncSNMP(SNMP):
+    """
+        asyncio flavour of SNMP.
+        netsnmp-py only has blocking calls, so every request is sent to an executor and awaited, letting one event
+    loop drive many switches at once. The blocking methods are kept, so Switch classes may use this session as any
+    other one from inside the executor threads.
+    """
+    executor = None  # None means the event loop default executor
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    async def start_async(self):
+        return await self._run(self.start)
+
+    async def get_async(self, oids_var):
+        return await self._run(self.get, oids_var)
+
+    async def getnext_async(self, oids_var):
+        return await self._run(self.getnext, oids_var)
+
+    async def walk_async(self, oids_var):
+        return await self._run(self.walk, oids_var)
+
+    async def set_async(self, oids_var, value, type_var):
+        return await self._run(self.set, oids_var, value, type_var)
+
+
+class SessionPool:
+    """
+        Open SNMP sessions, shared by everything that talks to the same agent (SwitchFactory, Switch, printers and
+    the tools of the probe page), keyed by (host, community, version). Sessions live across probe runs, so a long
+    running process (manage.py probed / probeworker) doesn't open them again on every cycle.
+        acquire() counts a reference and release() gives it back. A session without references is closed after
+    `idle` seconds (Settings.SNMP_SESSION_IDLE). A cancelled session (deadline of a probe) is never handed out again.
+    """
+    def __init__(self, idle=None):
+        self.idle = Settings.SNMP_SESSION_IDLE if idle is None else idle
+        # key: [session, references, time.monotonic() of the last release]
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, host, community='public', version=2):
+        """
+        :return: open AsyncSNMP session (usable by the blocking and the asyncio code). Must be given back with
+        release().
+        """
+        key = (host, community, version)
+        with self._lock:
+            self._evict()
+            entry = self._sessions.get(key)
+            if entry is not None and not entry[0].cancelled:
+                return self._take(entry)
+        # opened out of the lock: it may take a while (DNS). Two threads may open the same key at once: the first one
+        # goes to the pool, and the other thread uses it too, closing its own.
+        session = SnmpFactory.factory(host, community, version, asynchronous=True)
+        session.start()
+        with self._lock:
+            entry = self._sessions.get(key)
+            if entry is None or entry[0].cancelled:
+                self._sessions[key] = [session, 1, None]
+                return session
+            session_pooled = self._take(entry)
+        session.close()
+        return session_pooled
+
+    @staticmethod
+    def _take(entry):
+        """ One more reference to a pooled session. A new probe starts without the limits of the last one. """
+        entry[1] += 1
+        if entry[1] == 1:
+            entry[0].deadline = None
+            entry[0].max_varbinds = SNMP.max_varbinds
+        return entry[0]
+
+    def release(self, session):
+        with self._lock:
+            for key, entry in self._sessions.items():
+                if entry[0] is session:
+                    entry[1] -= 1
+                    entry[2] = time.monotonic()
+                    if session.cancelled:
+                        del self._sessions[key]
+                    break
+            # a session out of the pool (cancelled, or replaced) is closed by the garbage collector, as some executor
+            # thread may still be inside one of its requests
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        for key in [key for key, (_, references, released) in self._sessions.items()
+                    if references <= 0 and now - released >= self.idle]:
+            self._sessions.pop(key)[0].close()
+
+    def close(self):
+        """ Close every session without references. """
+        with self._lock:
+            for key in [key for key, (_, references, _) in self._sessions.items() if references <= 0]:
+                self._sessions.pop(key)[0].close()
+
+
+pool = SessionPool()
 
 
 class PseudoSnmp(SNMP):
@@ -79,6 +356,8 @@ class PseudoSnmp(SNMP):
     # where we store the files from snmpwalk -On
     path = '/opt/switches'
     _oid_ip = '.1.3.6.1.2.1.4.20.1.1'
+    # simulates agents limited to this number of OIDs per GET (answering tooBig). 0 = no limit.
+    agent_max_varbinds = 0
 
     # you should change this
 
@@ -86,6 +365,7 @@ class PseudoSnmp(SNMP):
         super().__init__(host, community, version)
         self.host = host
         self.mib = {}  # the place the mib is stored after reading the snmpwalk file
+        self._leaves = None  # every entry sorted by OID, used by getbulk()
         self.response = []  # one call at time, so one response.
         self._oid_ip_ext = '192.168'  # the switch IP starts with this. A hack to test integration with Models
         self.community = 'public'  # it doesn't matter
@@ -133,15 +413,20 @@ class PseudoSnmp(SNMP):
                 content = content[content.rfind('(') + 1:-1]
             pointer['content'] = content
 
-    def start(self):
+    def start(self, walk=None):
         """
         Load the snmpwalk file
+        :param walk: snmpwalk output to load instead of the file, for small fixtures kept in the tests
         """
-        filename = '{}/{}'.format(self.path, self.host)
-        if not os.path.isfile(filename):
-            raise ValueError("Cannot locate the test file for snmp: " + filename)
+        if walk is None:
+            filename = '{}/{}'.format(self.path, self.host)
+            if not os.path.isfile(filename):
+                raise ValueError("Cannot locate the test file for snmp: " + filename)
+            f = open(filename)
+        else:
+            f = io.StringIO(walk)
         pointer = {}
-        with open(filename) as f:
+        with f:
             content = ''
             for line in f:
                 # starts with OID
@@ -178,17 +463,19 @@ class PseudoSnmp(SNMP):
             if pointer:
                 self._format_content(pointer)
         v = self.getnext('{}.{}'.format(self._oid_ip, self._oid_ip_ext))[0]
-        if v[netsnmp.VALUE] != '-1':
-            self.host = v[netsnmp.VALUE]
+        if v[VALUE] != '-1':
+            self.host = v[VALUE]
 
     def _get_value(self, oids_var, p):
         if 'type' not in p:
             return self.NOOBJECT(oids_var)
         return [(oids_var, p['type'], p['content'])]
 
-    def get(self, oids_var):
+    def _get(self, oids_var):
         if type(oids_var) is str:
             oids_var = [oids_var]
+        if self.agent_max_varbinds and len(oids_var) > self.agent_max_varbinds:
+            raise SNMPError('tooBig')
         ret = []
         for i in oids_var:
             p = self._traverse(i)
@@ -219,6 +506,35 @@ class PseudoSnmp(SNMP):
             ret += self._getnext_str(i)
         return ret
 
+    @staticmethod
+    def _oid_key(oid):
+        return tuple(int(v) for v in oid.strip('.').split('.'))
+
+    def getbulk(self, oids_var, non_repeaters=0, max_repetitions=10):
+        """
+            Same answer order as a GETBULK PDU: the non repeaters first, then the repeaters interleaved by repetition.
+        """
+        if type(oids_var) is str:
+            oids_var = [oids_var]
+        if self._leaves is None:
+            self._leaves = []
+            self._walk_p(self.mib, self._leaves)
+            self._leaves.sort(key=lambda v: self._oid_key(v[0]))
+            self._leaves_keys = [self._oid_key(v[0]) for v in self._leaves]
+
+        def _next(oid, count):
+            pos = bisect.bisect_right(self._leaves_keys, self._oid_key(oid))
+            rows = self._leaves[pos:pos + count]
+            return rows + [(oid, 'ENDOFMIBVIEW', '')] * (count - len(rows))
+
+        ret = []
+        for oid in oids_var[:non_repeaters]:
+            ret += _next(oid, 1)
+        repeaters = [_next(oid, max_repetitions) for oid in oids_var[non_repeaters:]]
+        for i in range(max_repetitions):
+            ret += [rows[i] for rows in repeaters]
+        return ret
+
     def _walk_p(self, p, response):
         if 'type' in p: # it means we found an entry, let's save it
             response += [(p['oid'], p['type'], p['content'])]
@@ -239,6 +555,9 @@ class PseudoSnmp(SNMP):
             self._walk_p(p, response)
         return response
 
+    def iwalk(self, oids_var):
+        return iter(self.walk(oids_var))
+
     def __del__(self):
         pass
 
@@ -1,14 +1,13 @@
 import re
 import socket
-import netsnmp
 
 from netstatus.models import Printer
-from .snmp import SNMP
+from .snmp import TYPE, VALUE, pool
 
 
 def _format_snmp(result):
-    return (v[netsnmp.VALUE].replace('"', '')
-              if v[netsnmp.TYPE] not in ('NOSUCHINSTANCE', 'NOSUCHOBJECT', 'NULL') else -1
+    return (v[VALUE].replace('"', '')
+              if v[TYPE] not in ('NOSUCHINSTANCE', 'NOSUCHOBJECT', 'NULL') else -1
               for v in result)
 
 
@@ -19,9 +18,7 @@ def probe_snmp_printer(host, community='public'):
     if host == '':
         return ''
     try:
-        sess_snmp = SNMP(host, community)
-        if sess_snmp:
-            sess_snmp.start()
+        sess_snmp = pool.acquire(host, community)
     except:
         return 'Err opening snmp session'
 
@@ -34,29 +31,32 @@ def probe_snmp_printer(host, community='public'):
             '.1.3.6.1.2.1.2.2.1.6.1',       # mac1 - first possible place for the printer mac
             '.1.3.6.1.2.1.2.2.1.6.2',       # mac2
             ]
-    result = sess_snmp.get(oids)
-    # cleaning the data from SNMP
-    values = _format_snmp(result)
-    name, descr, hrdesc, pname, serial, brand, mac2, mac3 = values
-    dns = socket.gethostbyaddr(host)[0].split('.', 1)[0]
-
-    mac = ''
-    if mac2:
-        mac = mac2
-    else:
-        mac = mac3
-    mac = mac.strip().replace(' ', ':')
-    if len(mac) != 17:
-        # some switches omits the left digit if zero
-        mac = re.sub(r'^(.):', r'0\1', mac).lower().strip()
-        mac = re.sub(r':(.):', r':0\1:', mac)
-    if not pname or pname == -1:
-        result = sess_snmp.get(['.1.3.6.1.4.1.11.2.3.9.4.2.1.1.3.3.0', '.1.3.6.1.4.1.11.2.3.9.4.2.1.1.3.2.0'])
+    try:
+        result = sess_snmp.get(oids)
+        # cleaning the data from SNMP
         values = _format_snmp(result)
-        serial, pname = values
-        # these data are hex-coded strings.
-        serial = bytearray.fromhex(serial).decode()
-        pname = bytearray.fromhex(pname).decode()
+        name, descr, hrdesc, pname, serial, brand, mac2, mac3 = values
+        dns = socket.gethostbyaddr(host)[0].split('.', 1)[0]
+
+        mac = ''
+        if mac2:
+            mac = mac2
+        else:
+            mac = mac3
+        mac = mac.strip().replace(' ', ':')
+        if len(mac) != 17:
+            # some switches omits the left digit if zero
+            mac = re.sub(r'^(.):', r'0\1', mac).lower().strip()
+            mac = re.sub(r':(.):', r':0\1:', mac)
+        if not pname or pname == -1:
+            result = sess_snmp.get(['.1.3.6.1.4.1.11.2.3.9.4.2.1.1.3.3.0', '.1.3.6.1.4.1.11.2.3.9.4.2.1.1.3.2.0'])
+            values = _format_snmp(result)
+            serial, pname = values
+            # these data are hex-coded strings.
+            serial = bytearray.fromhex(serial).decode()
+            pname = bytearray.fromhex(pname).decode()
+    finally:
+        pool.release(sess_snmp)
 
     ip = host
     if not ip[0].isdigit():
@@ -1,11 +1,10 @@
+import asyncio
 import logging
 import math
 import sys
 
-import netsnmp
-
 from netstatus.lib.snmp import SNMP
-from netstatus.lib.snmp import SnmpFactory
+from netstatus.lib.snmp import pool
 from netstatus.settings import Settings
 from netstatus.lib.switch import switchlib
 from .switchlib import *
@@ -63,7 +62,9 @@ class Switch:
         'model':        '.1.3.6.1.2.1.47.1.1.1.1.13.',  # model
     }
     management_vlan = Settings.MANAGEMENT_VLAN
-    _map_baseport_ifindex = {}
+    # GETBULK max-repetitions used by walks on this kind of switch. None keeps Settings.SNMP_MAX_REPETITIONS.
+    # Subclasses with picky agents may lower it (or set 0 to walk with GETNEXT).
+    _max_repetitions = None
 
     @classmethod
     def is_compatible(cls, descr):
@@ -94,9 +95,10 @@ class Switch:
         self.vlans = []
         self.vtagged = {}
         self.vuntagged = {}
+        self._port_vlans = None
         self.intvlan = {}
-        self.macs = ()
-        self.macs_filtered = ()
+        self.macs = MacTable()
+        self.macs_filtered = MacTable()
         self.ip_mac = {}
         self.lldp = {}
         self.uplink = ()
@@ -107,8 +109,23 @@ class Switch:
         self.model = ''
         self.physical = ''
         self.mac = ''
+        # sysObjectID, set by SwitchFactory
+        self.object_id = ''
         self.stp = -1
         self.uptime = 0
+        self._baseport_ifindex = None
+        # (uptime, ports) of the last probe, for the incremental get_ports(). See set_previous()
+        self._previous = None
+        # get_ports() read only the ports changed since the last probe
+        self.ports_incremental = False
+        # load profile used by the last load()
+        self.profile = 'full'
+        # method being run by load() / load_async(), reported when the probe of this switch is cut by its deadline
+        self.phase = None
+        # DeviceCache entry restored by restore_cache()
+        self._cache = None
+        # sessions taken from the SessionPool, given back by close()
+        self._pooled = []
         # _fab_var is added to the end of _oids_fab. Sometimes, we don't need to change all the OIDs,
         # just the last part where this switch model stores some of its data.
         self._fab_var = '2'
@@ -119,17 +136,16 @@ class Switch:
         if isinstance(host, str):
             self.host = host
             self.comunidade = community
-            self.sessao = SnmpFactory.factory(host, community, version)
-            self.sessao.start()
+            self.sessao = pool.acquire(host, community, version)
+            self._pooled.append(self.sessao)
 
         if isinstance(host, SNMP):
             self.sessao = host
             self.host = host.host
             self.comunidade = host.community
 
-        # this index is per switch model, so a class attribute should be fine.
-        if not self._map_baseport_ifindex:
-            self.map_baseport()
+        if self._max_repetitions is not None:
+            self.sessao.max_repetitions = self._max_repetitions
 
     def set_start(self, comunidadew='private', version=2, force=False):
         """
@@ -146,13 +162,26 @@ class Switch:
             self.sessaow = self.sessao
             return
         self.comunidadew = comunidadew
-        self.sessaow = SNMP(self.host, comunidadew, version)
-        self.sessaow.start()
+        self.sessaow = pool.acquire(self.host, comunidadew, version)
+        self._pooled.append(self.sessaow)
+
+    def close(self):
+        """ Give the SNMP sessions back to the pool. The instance keeps its data, but can't ask the switch anymore. """
+        for session in self._pooled:
+            pool.release(session)
+        self._pooled = []
 
     def _map_bport_ifidx(self, port):
         port = int(port)
         return self._map_baseport_ifindex[port] if port in self._map_baseport_ifindex else port
 
+    @property
+    def _map_baseport_ifindex(self):
+        """ baseport <-> ifIndex map of this switch, walked on the first use (or restored by restore_cache()) """
+        if self._baseport_ifindex is None:
+            self.map_baseport()
+        return self._baseport_ifindex
+
     def map_baseport(self):
         """
         Get the relation baseport <-> ifIndex. Used to access some vlans, pvid and other data index as baseport instead
@@ -162,18 +191,20 @@ class Switch:
         :return: nothing. Sets the object variable _map_baseport_ifindex
         """
         oid_portifindex = '.1.3.6.1.2.1.17.1.4.1.2'
-        self._map_baseport_ifindex = {}
+        self._baseport_ifindex = {}
         for (_poid, _type, _ifindex) in self.sessao.walk(oid_portifindex):
             bidx = _poid.split('.')[-1]
-            self._map_baseport_ifindex[int(_ifindex)] = int(bidx)
+            self._baseport_ifindex[int(_ifindex)] = int(bidx)
 
     def get_geral(self):
         """
         Get basic info of this snmp equipment and uses the name in the OID dictionary as object attribute.
+        The entPhysical data (_oids_fab) is not asked when it was restored from the device cache.
         """
         tmp = {}
-        for k, v in self._oids_fab.items():
-            tmp[k] = v + self._fab_var
+        if self._cache is None:
+            for k, v in self._oids_fab.items():
+                tmp[k] = v + self._fab_var
         for k, v in self._oids_geral.items():
             tmp[k] = v
         oids = list(tmp.values())
@@ -184,30 +215,86 @@ class Switch:
         self.mac = format_mac(self.mac)
         self.stp = int(self.stp)
         # need to fix uptime, better leave to microseconds
-        time_values = self.uptime.split(':')
-        uptime = int(time_values[0]) * (24 * 3600 * 1000) + \
-                 int(time_values[1]) * 3600 * 1000 + \
-                 int(time_values[2]) * 60 * 1000 + \
-                 float(time_values[3]) * 1000
-        self.uptime = uptime
+        self.uptime = uptime_ms(self.uptime)
+        # rebooted or replaced since the cache entry was made: discover everything again
+        if self._cache is not None and (self.descr != self._cache['descr'] or self.uptime < self._cache['uptime']):
+            self._cache = None
+            self._baseport_ifindex = None
+            self.get_geral()
+
+    _cache_attrs = ('physical', 'soft_version', 'serial', 'vendor', 'model')
+
+    def cache_entry(self):
+        """
+        Slow changing data of this switch, for netstatus.lib.devicecache.DeviceCache. Need to call get_geral() first.
+        """
+        entry = {k: getattr(self, k) for k in self._cache_attrs}
+        entry['class'] = self.__class__.__name__
+        entry['descr'] = self.descr
+        entry['uptime'] = self.uptime
+        entry['baseport'] = self._map_baseport_ifindex
+        return entry
+
+    def restore_cache(self, entry):
+        """
+        Use a DeviceCache entry instead of asking the switch again for the baseport map and entPhysical data.
+        """
+        for k in self._cache_attrs:
+            setattr(self, k, entry[k])
+        # JSON keys are strings
+        self._baseport_ifindex = {int(k): v for k, v in entry['baseport'].items()}
+        self._cache = entry
+
+    # Named sets of methods for load(). 'macs' is the fast cycle for locating devices: FDB plus the LLDP neighbors,
+    # needed to filter out the uplinks. 'config' is everything but the FDB.
+    load_profiles = {
+        'full':     ('get_geral', 'get_vlans', 'get_ports', 'get_lldp_neighbors', 'get_mac_list'),
+        'macs':     ('get_geral', 'get_lldp_neighbors', 'get_mac_list'),
+        'config':   ('get_geral', 'get_vlans', 'get_ports', 'get_lldp_neighbors'),
+    }
 
-    def load(self):
+    def _load_phases(self, profile='full'):
+        """
+        Methods called by load() and load_async(), in this order. get_geral() must be the first one.
+        :param profile: key of load_profiles
+        """
+        if profile not in self.load_profiles:
+            raise ValueError('unknown load profile: {}'.format(profile))
+        self.profile = profile
+        return tuple(getattr(self, name) for name in self.load_profiles[profile])
+
+    def load(self, profile='full'):
         """
         Load every interesting characteristics, usually separated into several different methods,
          except the mac-ip list.
+        :param profile: which data is loaded, see load_profiles. The one used is kept in self.profile.
+        """
+        for phase in self._load_phases(profile):
+            self.phase = phase.__name__
+            phase()
+
+    async def load_async(self, executor=None, profile='full'):
         """
-        self.get_geral()
-        self.get_vlans()
-        self.get_ports()
-        self.get_lldp_neighbors()
-        self.get_mac_list()
+        Same as load(), for the asyncio probe scheduler. SNMP calls are blocking, so each phase runs in the executor
+        while the event loop keeps going with other switches.
+        :param executor: concurrent.futures executor. None uses the event loop default one.
+        :param profile: as in load()
+        """
+        loop = asyncio.get_running_loop()
+        for phase in self._load_phases(profile):
+            self.phase = phase.__name__
+            await loop.run_in_executor(executor, phase)
+
+    def loaded(self, method):
+        """ Tells if the last load() called this method (by name), e.g. loaded('get_ports') """
+        return method in self.load_profiles[self.profile]
 
     def _vlans_list(self):
         """
         Safe method for several types. However, for some models we may change that
-        (get values from netsnmp.VALUE)
+        (get values from VALUE)
         """
-        return {v[netsnmp.OID].split('.')[-1]: v[netsnmp.VALUE] for v in self.sessao.walk(self._oids_vlans['vlans'])}
+        return {v[OID].split('.')[-1]: v[VALUE] for v in self.sessao.walk(self._oids_vlans['vlans'])}
 
     def get_vlans(self):
         """
@@ -217,7 +304,7 @@ class Switch:
         Problems: each switch store vlans in different OIDs, you need to dig out that info.
         Some switches brings the vlan list out of order or the value into the OID body instead the VALUE part of the
         request. Huawei switches store all possible vlans, even if not created, so we need to filter out that too.
-        :return: set tagged and untagged vlans as dictionary vlan (key) = tuple(integer,)
+        :return: set tagged and untagged vlans as dictionary vlan (key) = portlist (bytes)
         """
         self._vlans_index = self._vlans_list()
         self.vlans = tuple(sorted(self._vlans_index.values()))
@@ -225,39 +312,74 @@ class Switch:
         #logging.debug(('-- vlans: ', self.vlans))
         self.vtagged = {}
         self.vuntagged = {}
+        self._port_vlans = None
         """
         Vlans are represented as a byte string where the bit position means the port.
-        This will be converted to a dictionary where key = vlan number  and  value is a tuple with ports as integer
+        This will be converted to a dictionary where key = vlan number  and  value is the portlist as bytes.
         Filters out vlans not created.
-        Be careful with lots of GET message in the same request. If the response becomes too big, SNMP server returns
-        error to us.
-        """
-        for x in self._vlans_index.keys():
-            oid = '{}.{}'.format(self._oids_vlans['tagged'], x)
-            y = snmp_values(self.sessao.get(oid))[0]
-            self.vtagged[self._vlans_index[x]] = tuple(int(w, 16) for w in y.strip().replace('\n', '').split(' '))
-
-            oid = '{}.{}'.format(self._oids_vlans['untagged'], x)
-            y = snmp_values(self.sessao.get(oid))[0]
-            self.vuntagged[self._vlans_index[x]] = tuple(int(w, 16) for w in y.strip().replace('\n', '').split(' '))
+        Both portlist columns are walked once, instead of two GETs for each vlan.
+        """
+        tagged = self._walk_column(self._oids_vlans['tagged'])
+        untagged = self._walk_column(self._oids_vlans['untagged'])
+        # Some agents index the portlists differently from the vlan list. Those are asked directly, all at once.
+        missing = [x for x in self._vlans_index if x not in tagged or x not in untagged]
+        if missing:
+            oids = ['{}.{}'.format(self._oids_vlans['tagged'], x) for x in missing] + \
+                   ['{}.{}'.format(self._oids_vlans['untagged'], x) for x in missing]
+            values = snmp_values(self.sessao.get(oids))
+            tagged.update(zip(missing, values[:len(missing)]))
+            untagged.update(zip(missing, values[len(missing):]))
+        for x, vlan in self._vlans_index.items():
+            self.vtagged[vlan] = portlist_bytes(tagged[x])
+            self.vuntagged[vlan] = portlist_bytes(untagged[x])
+
+    def _vlan_bitsets(self):
+        """
+        Portlists of all vlans as int bitsets (bit n = port n + 1), honouring the switch mask.
+        :return: {vlan: (tagged bits, untagged bits)}. Tagged bits exclude the untagged ports, as egress portlists
+        hold both.
+        """
+        table = portlist_table(self._mask)
+        bitsets = {}
+        for vlan in self.vlans:
+            u = portlist_int(self.vuntagged[vlan], table)
+            bitsets[vlan] = (portlist_int(self.vtagged[vlan], table) & ~u, u)
+        return bitsets
+
+    def _build_port_vlans(self):
+        """
+        Port x vlan membership, built once from the portlists after get_vlans().
+        :return: {port: (tagged vlans, untagged vlans)}, vlans in the same order of self.vlans
+        """
+        port_vlans = {}
+        for vlan, (t, u) in self._vlan_bitsets().items():
+            for port in bitset_ports(t):
+                port_vlans.setdefault(port, ([], []))[0].append(vlan)
+            for port in bitset_ports(u):
+                port_vlans.setdefault(port, ([], []))[1].append(vlan)
+        return port_vlans
 
     def _vlans_ports(self, port):  # , pvid):
         """
         Get VLANS associate to a port. Need to call get_vlans() before this one.
-        There are list of vlans with ports, this way the port will be searched to discover the vlans
+        The port x vlan membership is built on the first call and reused for the other ports.
         :param port: the switch port
         :return: tuple with tagged and untagged vlans as string each
         """
-        vtag = []
-        vuntag = []
-        for j in self.vlans:
-            t = self.portlist(self.vtagged[j], port)
-            u = self.portlist(self.vuntagged[j], port)
-            if t > 0 and u == 0:
-                vtag += [j]
-            if u > 0:
-                vuntag += [j]
-        return vtag, vuntag
+        if self._port_vlans is None:
+            self._port_vlans = self._build_port_vlans()
+        vtag, vuntag = self._port_vlans.get(int(port), ((), ()))
+        return list(vtag), list(vuntag)
+
+    def vlan_ports(self, vlan):
+        """
+        Ports that carry a vlan. Need to call get_vlans() before this one.
+        :param vlan: vlan number, as string
+        :return: tuple with tagged and untagged ports (base port numbers)
+        """
+        table = portlist_table(self._mask)
+        u = portlist_int(self.vuntagged.get(vlan, b''), table)
+        return bitset_ports(portlist_int(self.vtagged.get(vlan, b''), table) & ~u), bitset_ports(u)
 
     def portlist(self, portlist, port):
         """
@@ -299,10 +421,7 @@ class Switch:
     def _snmp_ports_vtype(self, port):
         port = str(port)
         oidlist = ['.'.join([self._ifVLANType, port])]
-        ret = []
-        for i in oidlist:
-            ret += self.sessao.get(i)
-        return ret
+        return self.sessao.get(oidlist)
 
     def _oid_mpoe(self, port):
         """ Return OID for power power consume, vendor dependent.  """
@@ -346,24 +465,77 @@ class Switch:
         # ethernetCsmacd = 6, gigabitEthernet = 117
         return True if iftype in (117, 6) else False
 
+    def _walk_column(self, oid):
+        """ Walk a table column. :return: {row index (str): value} """
+        oid = oid.rstrip('.')
+        return snmp_values_column(self.sessao.walk(oid), oid)
+
+    def _port_columns(self):
+        """
+        Columns walked by get_ports(), as (key, OID, indexed by baseport instead of ifIndex).
+        Built from _oids_ports, _oids_stp, _oid_poe(), _oid_mpoe() and _ifVLANType, so subclasses changing those
+        also change the bulk load. Overwrite this to add or drop columns.
+        """
+        columns = [(k, v, False) for k, v in self._oids_ports.items()]
+        columns += [(k, v, True) for k, v in zip(('stp_admin', 'stp_state', 'stp_pvid'), self._oids_stp)]
+        columns += [(k, v, False) for k, v in zip(('poe_admin', 'poe_status', 'poe_class', 'poe_mpower'),
+                                                  self._oid_poe('') + self._oid_mpoe(''))]
+        columns += [('vtype', self._ifVLANType, False)]
+        return columns
+
     # preferência por filtrar apenas portas ethernet (ignorar int. vlans e outras interfaces)
     def get_ports(self):
         """
         Get the switches ports, filtering to get only ether type - sometimes interface vlan appear here, it depends
         on the switch.
+        Each column of _port_columns() is walked once for the whole table and the rows are joined by ifIndex (or
+        baseport), instead of several GETs for each port as get_port_ether() does.
         :return: set a dictionary indexed by port number
         """
         # Checking with ifType if the port is ethernet type (may be interface vlan or anything else).
-        # avoids calling get_port_ether() for non ethernet type.
+        # avoids loading data from non ethernet type.
         oid_iftype = '.1.3.6.1.2.1.2.2.1.3'
-        for (_oid, _type, _value) in self.sessao.walk(oid_iftype):
-            #port = self._map_bport_ifidx(int(_oid[(len(oid_iftype) + 1):]))
-            port = int(_oid[(len(oid_iftype) + 1):])
-            iftype = int(_value)
-
-            if self._is_port_ether(iftype):  # and port in self._map_baseport_ifindex:
-                # self.portas[port] = self.get_port_ether(port)
-                self.portas[self._map_bport_ifidx(port)] = self.get_port_ether(port)
+        ports = [int(i) for i, v in self._walk_column(oid_iftype).items() if self._is_port_ether(int(v))]
+        if not ports:
+            return
+        # same boot as the last probe: ifLastChange tells which ports need to be read again
+        if self._previous is not None and self._previous[0] <= self.uptime:
+            self.ports_incremental = True
+            return self._get_ports_incremental(ports)
+        columns = [(k, self._walk_column(oid), by_baseport) for k, oid, by_baseport in self._port_columns()]
+        for port in ports:
+            ifindex = str(port)
+            bport = str(self._map_bport_ifidx(port))
+            # -1 for missing entries, as snmp_values(filter_=True) does
+            values = {k: rows.get(bport if by_baseport else ifindex, -1) for k, rows, by_baseport in columns}
+            self.portas[self._map_bport_ifidx(port)] = self._port_values(port, values)
+
+    # columns refreshed for every port by the incremental get_ports(). The rest only for ports with a new ifLastChange
+    _oids_ports_counters = ('iflast', 'ifindis', 'ifoutdis', 'ifhcinoct', 'ifhcoutoct', 'ifinoct', 'ifoutoct')
+
+    def set_previous(self, uptime, ports):
+        """
+        State of this switch in the last probe, usually from the database. With it, get_ports() only walks
+        ifLastChange and the counters, reading the whole configuration (STP, PoE, vlans, alias) only of the ports whose
+        ifLastChange is different from the last probe. A reboot (uptime going backwards) loads everything again.
+        Note that changes which don't touch the link state (vlans, PoE, alias) are only seen on the next full load,
+        forced by probe._previous_state() after Settings.PROBE_FULL_LOAD_AGE.
+        :param uptime: sysUpTime in milliseconds, as self.uptime
+        :param ports: {port: dictionary as in self.portas}
+        """
+        self._previous = (uptime, ports)
+
+    def _get_ports_incremental(self, ports):
+        previous = self._previous[1]
+        columns = {k: self._walk_column(self._oids_ports[k]) for k in self._oids_ports_counters}
+        for port in ports:
+            bport = self._map_bport_ifidx(port)
+            values = {k: rows.get(str(port), -1) for k, rows in columns.items()}
+            last = previous.get(bport)
+            if last is None or values['iflast'] == -1 or last['lastchange'] != timeticks(values['iflast']):
+                self.portas[bport] = self.get_port_ether(port)
+                continue
+            self.portas[bport] = dict(last, mac_count=0, **self._port_counters(values))
 
     _oids_intvlan = (
         '.1.3.6.1.4.1.43.45.1.2.23.1.2.1.2.1.3',  # hwdot1qVlanIpAddress - "IP address of interface."
@@ -384,86 +556,106 @@ class Switch:
                 continue
             self.intvlan[int(vlan)] = tuple(valores)
 
+    # ifTable / ifXTable / EtherLike-MIB columns of each ethernet port, indexed by ifIndex
+    _oids_ports = {
+        'ifdesc':       '.1.3.6.1.2.1.2.2.1.2',
+        'ifspeed':      '.1.3.6.1.2.1.2.2.1.5',
+        'ifadmin':      '.1.3.6.1.2.1.2.2.1.7',
+        'ifoper':       '.1.3.6.1.2.1.2.2.1.8',
+        'iflast':       '.1.3.6.1.2.1.2.2.1.9',
+        'ifindis':      '.1.3.6.1.2.1.2.2.1.13',
+        'ifoutdis':     '.1.3.6.1.2.1.2.2.1.19',
+        'ifduplex':     '.1.3.6.1.2.1.10.7.2.1.19',
+        'ifalias':      '.1.3.6.1.2.1.31.1.1.1.18',
+        'ifhcinoct':    '.1.3.6.1.2.1.31.1.1.1.6',
+        'ifhcoutoct':   '.1.3.6.1.2.1.31.1.1.1.10',
+        'ifinoct':      '.1.3.6.1.2.1.2.2.1.10',
+        'ifoutoct':     '.1.3.6.1.2.1.2.2.1.16',
+    }
+
     def get_port_ether(self, port):
         """
-        Get internet / ethernet ports (not interface vlan or other types)
+        Get internet / ethernet ports (not interface vlan or other types), one port at time.
+        get_ports() loads all ports at once, which is much faster for the whole switch.
         :param port: must be int
         :return:
         """
         # some functions need this as integer, so we will do it only once.
         i = str(port)
 
-        # Order of OIDs:
-        # ifdesc ifmtu ifspeed ifphys ifadmin ifoper iflast ifindis ifoutdis 
-        oidlist = ['.1.3.6.1.2.1.2.2.1.' + v + '.' + i for v in ('2', '4', '5', '6', '7', '8', '9', '13', '19')]
-        # ifduplex ifalias  ifHCInOctets ifHCOutOctets, ifInOctets, ifOutOctets
-        oidlist += ['.1.3.6.1.2.1.10.7.2.1.19.' + i, '.1.3.6.1.2.1.31.1.1.1.18.' + i,
-                    '.1.3.6.1.2.1.31.1.1.1.6.' + i, '.1.3.6.1.2.1.31.1.1.1.10.' + i,
-                    '.1.3.6.1.2.1.2.2.1.10.' + i, '.1.3.6.1.2.1.2.2.1.16.' + i]
-        result = self.sessao.get(oidlist)
-
-        values = snmp_values(result, filter_=True)
-        ifdesc, ifmtu, ifspeed, ifphys, ifadmin, ifoper, iflast, ifindis, \
-        ifoutdis, ifduplex, ifalias, ifhcinoct, ifhcoutoct, ifinoct, ifoutoct = values
-        ifinoct  = ifhcinoct if ifinoct < ifhcinoct else ifinoct
-        ifoutoct = ifhcoutoct if ifoutoct < ifhcoutoct else ifoutoct
+        oidlist = [v + '.' + i for v in self._oids_ports.values()]
+        values = dict(zip(self._oids_ports.keys(), snmp_values(self.sessao.get(oidlist), filter_=True)))
         # Specific things for each vendor / model. Uses separated methods for easier overload.
         result = []
         result += self._snmp_ports_stp(i)  # uses dot1dBasePort
         result += self._snmp_ports_poe(i)
         result += self._snmp_ports_vtype(i)
-        values = snmp_values(result, filter_=True)
-        stp_admin, stp_state, stp_pvid, poe_admin, poe_status, poe_class, poe_mpower, vtype = values
-        del result, oidlist, values
+        values.update(zip(('stp_admin', 'stp_state', 'stp_pvid', 'poe_admin', 'poe_status', 'poe_class',
+                           'poe_mpower', 'vtype'), snmp_values(result, filter_=True)))
+        return self._port_values(port, values)
 
-        ifspeed = int(ifspeed)
+    def _port_values(self, port, values):
+        """
+        Convert the raw SNMP values of a port, from get_ports() or get_port_ether(), to the port dictionary.
+        :param port: ifIndex, as int
+        :param values: {key: value} with the keys of _oids_ports plus stp_admin, stp_state, stp_pvid, poe_admin,
+                       poe_status, poe_class, poe_mpower and vtype
+        """
+        ifspeed = int(values['ifspeed'])
         ifspeedn = int(ifspeed / 1000000) if ifspeed > 0 else ifspeed
-        # \-- iflast, when the interface last changed, format TimeTicks =  0:00:00.00
-        iflast = int(sum([part * base for part, base in
-                          zip((86400, 3600, 60, 1), map(float, iflast.split(':')))]) * 100)
         # Some switches are too much verbose on interface description. Altough the max length check should be done by
         # other class, it won't know how handle the information contained here except trunking the string to a certain
         # length.
         # So, specially for D-LINKs, any subclass should rewrite this description to best fit its purpose of describing
         # the port.
-        ifdesc = self._format_ifdesc(ifdesc)
+        ifdesc = self._format_ifdesc(values['ifdesc'])
 
         vtag = []
         vuntag = []
         # 2 = port access, vtag and vuntag are not applicable.
-        if vtype != '2':
+        if values.get('vtype') != '2':
             vtag, vuntag = self._vlans_ports(self._map_bport_ifidx(port))
             if len(vtag) > 4090:  # probably trunking port with 'permit vlan all' and all vlans created.
                 vtag = [4095, ]
 
-        #logging.debug('-- port {} ({}), vtag = "{}", vuntag = "{}", pvid = {}, stp_admin = {}'
-        #              '\n======================================='.format(
-        #              str(port), str(ifdesc), vtag, vuntag, stp_pvid, stp_admin))
         return {
             'speed': ifspeedn,
-            'duplex': int(ifduplex),
-            'admin': int(ifadmin),
-            'oper': int(ifoper),
-            'lastchange': iflast,
-            'discards_in': int(ifindis),
-            'discards_out': int(ifoutdis),
-            'oct_in': int(ifinoct),
-            'oct_out': int(ifoutoct),
-            'stp_admin': int(stp_admin),
-            'stp_state': int(stp_state),
-            'poe_admin': int(poe_admin),
-            'poe_detection': self._conv_poe_status(poe_status),
-            'poe_class': int(poe_class),
-            'poe_mpower': int(poe_mpower),
+            'duplex': int(values['ifduplex']),
+            'admin': int(values['ifadmin']),
+            'oper': int(values['ifoper']),
+            **self._port_counters(values),
+            'stp_admin': int(values['stp_admin']),
+            'stp_state': int(values['stp_state']),
+            'poe_admin': self._conv_poe_admin(values['poe_admin']),
+            'poe_detection': self._conv_poe_status(values['poe_status']),
+            'poe_class': int(values['poe_class']),
+            'poe_mpower': int(values['poe_mpower']),
             'mac_count': 0,
-            'pvid': stp_pvid,
+            'pvid': values['stp_pvid'],
             'tagged': vtag,
             'untagged': vuntag,
             # data: will be defined somewhere else.
             'nome': ifdesc,
-            'alias': ifalias,
+            'alias': values['ifalias'],
+        }
+
+    @staticmethod
+    def _port_counters(values):
+        """ lastchange and traffic counters of a port, from the _oids_ports_counters values """
+        ifinoct = values['ifhcinoct'] if values['ifinoct'] < values['ifhcinoct'] else values['ifinoct']
+        ifoutoct = values['ifhcoutoct'] if values['ifoutoct'] < values['ifhcoutoct'] else values['ifoutoct']
+        return {
+            # \-- iflast, when the interface last changed, format TimeTicks =  0:00:00.00
+            'lastchange': timeticks(values['iflast']),
+            'discards_in': int(values['ifindis']),
+            'discards_out': int(values['ifoutdis']),
+            'oct_in': int(ifinoct),
+            'oct_out': int(ifoutoct),
         }
 
+    def _conv_poe_admin(self, poe_admin):
+        return int(poe_admin)
+
     def _conv_poe_status(self, poe_status):
         return int(poe_status)
 
@@ -473,23 +665,26 @@ class Switch:
         """
         Get a MAC list. Based on Q-BRIDGE-MIB :: dot1qTpFdbPort
         :param filterLLDP: don't store macs in uplinks
-        :return: ((porta, mac, vlan),)
+        :return: nothing. Sets self.macs and self.macs_filtered as MacTable, read as ((porta, mac, vlan),)
         """
-        macs = self.sessao.walk(self._oid_macs)
-        logging.debug("macs = {}".format(macs))
-        for (oid, _type, port) in macs:
+        self.macs = MacTable()
+        self.macs_filtered = MacTable()
+        uplink = set(self.uplink) if filterLLDP else set()
+        bport_ifidx = self._map_baseport_ifindex
+        for (oid, _type, port) in self.sessao.iwalk(self._oid_macs):
             oid = oid.strip().split('.')
-            port = self._map_bport_ifidx(int(port))
-            if filterLLDP and port in self.uplink:
+            port = int(port)
+            port = bport_ifidx.get(port, port)
+            if port in uplink:
                 continue
             # get VLAN and MAC from OID
             vlan = int(oid[14])
-            mac = '{:02x}:{:02x}:{:02x}:{:02x}:{:02x}:{:02x}'.format(*(int(v) for v in oid[15:]))
+            mac = int.from_bytes(bytes(int(v) for v in oid[15:]), 'big')
             # blacklist or configuration like static, interface vlan, etc
             if port == 0:
-                self.macs_filtered += ((port, mac, vlan),)
+                self.macs_filtered.append(port, mac, vlan)
             else:
-                self.macs += ((port, mac, vlan),)
+                self.macs.append(port, mac, vlan)
 
     def _lldp_is_uplink(self, lport, lldp_port):
         """
@@ -543,6 +738,12 @@ class Switch:
         'locportdesc': '.1.0.8802.1.1.2.1.3.7.1.4',
     }
 
+    @staticmethod
+    def _lldp_row(column, prefix):
+        """ First value of a lldpRemTable column starting with prefix (timeMark.localPort), or '-1' """
+        prefix += '.'
+        return next((v for k, v in column.items() if k.startswith(prefix)), '-1')
+
     def get_lldp_neighbors(self):
         """
         Get neighbors through LLDP.
@@ -551,6 +752,12 @@ class Switch:
         self.lldp = {}
         #logging.debug("--> : [{} / {}] LLDP: self.lldp {}.".format(self.name, self.host, str(self.lldp)))
         neighbors = self.sessao.walk(self._oids_lldp_mac)
+        if not neighbors:
+            return self.lldp
+        # lldpLocPortTable is indexed by local port, lldpRemTable by (timeMark, localPort, index).
+        # Each column is walked once and joined here, instead of asking every neighbor separately.
+        local = {k: self._walk_column(o) for k, o in self._oids_lldp_local.items()}
+        remote = {k: self._walk_column(o) for k, o in self._oids_lldp.items()}
         for (oid, tipo, _rmac) in neighbors:
             oid = oid.replace(self._oids_lldp_mac, '').split('.')
             # Some devices register the port multiple times, only differs by a temporal key in the OID.
@@ -561,16 +768,13 @@ class Switch:
                 logging.debug(
                     "--> NOTE: [{} / {}] LLDP: port {} already registered.".format(self.name, self.host, lport))
                 continue
-            snmpId = oid[1]
+            row = '.'.join(oid[1:])
             # other data needed to identify the relation with neighbors
-            res = {}
-            for k, o in self._oids_lldp_local.items():
-                logging.debug("{} = {}".format(k, self.sessao.get('.'.join((o, str(lport))))[0][2]))
-                res[k] = snmp_values(self.sessao.get('.'.join((o, str(lport)))))[0]
-
-            for k, o in self._oids_lldp.items():
-                # D-LINK gives some errors, so we need to do some adjusts
-                res[k] = snmp_values(self.sessao.getnext('.'.join((o, snmpId, str(lport)))))[0]
+            res = {k: column.get(str(lport), '-1') for k, column in local.items()}
+            for k, column in remote.items():
+                # D-LINK gives some errors (the row index differs between columns), so we need to do some adjusts:
+                # take the first row of the same timeMark and local port.
+                res[k] = column[row] if row in column else self._lldp_row(column, '.'.join(oid[1:3]))
 
             """
             lldpRemPortIdSubtype
@@ -63,18 +63,11 @@ class SwitchDLINK(Switch):
 
     poe_admin_mapping = {'1': '-1', '2': '1', '3': '2'}
 
-    def _snmp_ports_poe(self, port):
+    def _conv_poe_admin(self, poe_admin):
         """
         Remap the values received by the switch from POE admin status to ones we prefer to use.
-        :param port:
-        :return: the POE values changed.
         """
-        def _remap(var_dict, value):
-            return var_dict[value] if value in var_dict else value
-        ret = super()._snmp_ports_poe(port)
-        tmp = _remap(self.poe_admin_mapping, ret[0][netsnmp.VALUE])
-        ret[0] = (ret[0][0], ret[0][1], tmp)
-        return ret
+        return int(self.poe_admin_mapping.get(poe_admin, poe_admin))
 
     def _snmp_ports_vtype(self, port):
         """
@@ -85,6 +78,10 @@ class SwitchDLINK(Switch):
         """
         return [['', '', '0']]
 
+    def _port_columns(self):
+        """ Same reason of _snmp_ports_vtype(): there is no port vlan type column to walk. """
+        return [c for c in super()._port_columns() if c[0] != 'vtype']
+
     # Aqui depende novamente da configuração no switch. Convencionou-se que o nome
     # da interface vlan (3Com / HPN não tem nome) seja criado com o número da VLAN
     # associada, já que é muito trabalhoso achar, neste modelo, a vlan associada a
@@ -1,6 +1,5 @@
 from .Switch import Switch
-
-import netsnmp
+from .switchlib import OID
 
 
 class SwitchHuawei(Switch):
@@ -55,7 +54,7 @@ class SwitchHuawei(Switch):
         """ Couldn't find an entry for index list of vlans. This OID will bring description instead, so we 
         need to adapt the output to what we expect.
         """
-        return {v[netsnmp.OID].split('.')[-1]: v[netsnmp.OID].split('.')[-1] for v in self.sessao.walk(self._oids_vlans['vlans'])}
+        return {v[OID].split('.')[-1]: v[OID].split('.')[-1] for v in self.sessao.walk(self._oids_vlans['vlans'])}
 
 
 class SwitchHuaweiS5700(SwitchHuawei):
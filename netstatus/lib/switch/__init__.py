@@ -1,6 +1 @@
-# Needed, or the SwitchFactory won't find dynamically all the subclasses of Switch
-import pkgutil
-__path__ = pkgutil.extend_path(__path__, __name__)
-for importer, modname, ispkg in pkgutil.walk_packages(path=__path__, prefix=__name__+'.'):
-    __import__(modname)
-
+# The vendor modules (Switch subclasses) are imported on demand by SwitchFactory: see vendors.py
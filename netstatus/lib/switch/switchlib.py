@@ -1,25 +1,67 @@
 """
     Static functions for Switch classes
 """
-import netsnmp
+from array import array
+
+from netstatus.lib.snmp import OID, TYPE, VALUE
 
 
 def format_mac(value):
     return value.replace('"', '').strip().replace(' ', ':').lower()
 
 
+def format_mac_int(value):
+    """ 48 bits int to aa:bb:cc:dd:ee:ff """
+    return ':'.join('{:02x}'.format(b) for b in value.to_bytes(6, 'big'))
+
+
+def uptime_ms(value):
+    """ TimeTicks as given by netsnmp-py (d:hh:mm:ss.cc) to milliseconds """
+    time_values = value.split(':')
+    return int(time_values[0]) * (24 * 3600 * 1000) + \
+        int(time_values[1]) * 3600 * 1000 + \
+        int(time_values[2]) * 60 * 1000 + \
+        float(time_values[3]) * 1000
+
+
+def timeticks(value):
+    """ TimeTicks as given by netsnmp-py (d:hh:mm:ss.cc) to hundredths of second, the raw SNMP value """
+    return int(sum([part * base for part, base in zip((86400, 3600, 60, 1), map(float, value.split(':')))]) * 100)
+
+
 def snmp_values(values, filter_=False):
     """ Clean the OID data from SNMP library """
     if filter_:
-        return (v[netsnmp.VALUE].replace('"', '')
-                if v[netsnmp.TYPE] not in ('NOSUCHINSTANCE', 'NOSUCHOBJECT', 'NULL') else -1
+        return (v[VALUE].replace('"', '')
+                if v[TYPE] not in ('NOSUCHINSTANCE', 'NOSUCHOBJECT', 'NULL') else -1
                 for v in values
                 )
-    return [v[netsnmp.VALUE].replace('"', '') for v in values]
+    return [v[VALUE].replace('"', '') for v in values]
 
 
 def snmp_values_dict(values):
-    return {v[netsnmp.OID].split('.')[-1]: v[netsnmp.VALUE].replace('"', '') for v in values}
+    return {v[OID].split('.')[-1]: v[VALUE].replace('"', '') for v in values}
+
+
+def snmp_values_column(values, column):
+    """
+    Index a walk of a table column by the OID part after the column (the row index, as string). Rows outside the
+    column are ignored.
+    """
+    prefix = column.strip('.') + '.'
+    return {v[OID].lstrip('.')[len(prefix):]: v[VALUE].replace('"', '')
+            for v in values if v[OID].lstrip('.').startswith(prefix)}
+
+
+def portlist_bytes(value):
+    """
+    Decode a PortList (Hex-STRING) value as bytes, e.g. '"FF 0A\n 00 "' -> b'\xff\n\x00'.
+    Empty or invalid values (missing entries) are an empty portlist.
+    """
+    try:
+        return bytes.fromhex(value.replace('"', ''))
+    except (ValueError, AttributeError):
+        return b''
 
 
 # def mask_bigendian(nport):
@@ -41,6 +83,68 @@ def mask_bigendian(nport):
     return 128 >> (nport % 8)
 
 
+def portlist_table(mask):
+    """
+    Translation table (for bytes.translate) that reorders the bits of each portlist octet so the lowest numbered
+    port of the octet ends in the least significant bit, whatever mask the switch uses.
+    """
+    return bytes(sum(1 << k for k in range(8) if octet & mask(k)) for octet in range(256))
+
+
+def portlist_int(portlist, table):
+    """
+    Convert a portlist to an int bitset where bit n is port n + 1.
+    :param portlist: bytes (or a sequence of octets)
+    :param table: from portlist_table()
+    """
+    return int.from_bytes(bytes(portlist).translate(table), 'little')
+
+
+def bitset_ports(bits):
+    """ Ports (1 based) set in an int bitset from portlist_int() """
+    ports = []
+    while bits:
+        low = bits & -bits
+        ports.append(low.bit_length())
+        bits ^= low
+    return ports
+
+
+class MacTable:
+    """
+    MAC addresses learned by a switch (FDB), stored as three array columns: port, vlan and the MAC as a 48 bits int.
+    A core switch may have tens of thousands of entries, which as tuples of strings take several times the memory.
+    The entries are read as (port, mac, vlan), with the MAC formatted only at that moment (e.g. when persisting).
+    """
+    def __init__(self):
+        self.ports = array('L')
+        self.vlans = array('H')
+        self.macs = array('Q')
+
+    def append(self, port, mac, vlan):
+        """
+        :param port: ifIndex
+        :param mac: 48 bits int
+        :param vlan: vlan number
+        """
+        self.ports.append(port)
+        self.vlans.append(vlan)
+        self.macs.append(mac)
+
+    def raw(self):
+        """ Entries as (port, mac as int, vlan) """
+        return zip(self.ports, self.macs, self.vlans)
+
+    def __len__(self):
+        return len(self.macs)
+
+    def __getitem__(self, i):
+        return self.ports[i], format_mac_int(self.macs[i]), self.vlans[i]
+
+    def __iter__(self):
+        return ((port, format_mac_int(mac), vlan) for port, mac, vlan in self.raw())
+
+
 def lldp_is_uplink_extra(switch, lport, lldp_port):
     """
     Specifics checks. You may want to change this.
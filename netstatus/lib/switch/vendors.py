@@ -0,0 +1,54 @@
+"""
+    Registry of the vendor modules of this package, so SwitchFactory imports only the ones a switch may belong to.
+    Who never classifies a switch (web views, tests, manage.py) doesn't load them.
+"""
+import importlib
+import re
+
+from .Switch import Switch
+
+# (module, sysDescr regex, sysObjectID enterprise prefixes), in the order the vendors are tried.
+# A vendor is a candidate when the regex matches the start of sysDescr (ignoring case) or sysObjectID is under one of
+# its enterprises; then is_compatible() of its classes decides, as before. The regex must accept every sysDescr that
+# the is_compatible() of the vendor root classes accepts.
+# The Switch subclasses of each module must have names starting with the module name (see load_class()).
+VENDORS = (
+    ('Switch3Com',    r'3com',           ('.1.3.6.1.4.1.43.',)),
+    ('SwitchDLINK',   r'dgs',            ('.1.3.6.1.4.1.171.',)),
+    ('SwitchExtreme', r'extremexos',     ('.1.3.6.1.4.1.1916.',)),
+    ('SwitchHH3C',    r'hp',             ('.1.3.6.1.4.1.25506.', '.1.3.6.1.4.1.11.')),
+    ('SwitchHuawei',  r'[^\n]*\nhuawei', ('.1.3.6.1.4.1.2011.',)),
+)
+
+_matchers = [(module, re.compile(descr, re.IGNORECASE), enterprises) for module, descr, enterprises in VENDORS]
+
+
+def _import(module):
+    return importlib.import_module('{}.{}'.format(__package__, module))
+
+
+def candidates(descr, object_id=''):
+    """
+    :param descr: sysDescr
+    :param object_id: sysObjectID, or empty
+    :return: the classes directly under Switch of the vendors this switch may be from, importing their modules
+    """
+    object_id = '.' + object_id.lstrip('.') if object_id else ''
+    found = []
+    for module, descr_re, enterprises in _matchers:
+        if descr_re.match(descr) or (object_id and object_id.startswith(enterprises)):
+            name = _import(module).__name__
+            found += [c for c in Switch.__subclasses__() if c.__module__ == name]
+    return found
+
+
+def load_class(name):
+    """
+    Import the module of the Switch subclass with this name (as saved by DeviceCache or the switches table).
+    :return: False when no vendor module has it
+    """
+    for module, _, _ in VENDORS:
+        if name.startswith(module):
+            _import(module)
+            return True
+    return False
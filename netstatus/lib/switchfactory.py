@@ -1,6 +1,42 @@
-from .snmp import SnmpFactory
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from .snmp import SNMPError, pool
+from .switch import vendors
 from .switch.Switch import *
-from netsnmp._api import SNMPError
+
+
+class ClassificationCache:
+    """
+    LRU of the Switch class (by name) picked for each (sysObjectID, sysDescr), so each description is classified by
+    SwitchFactory._type() only once. probe._switch_status() seeds it with the classes saved in the switches table.
+    """
+    def __init__(self, size=None):
+        self.size = Settings.CLASSIFICATION_CACHE_SIZE if size is None else size
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(object_id, descr):
+        return object_id or '', ' '.join(str(descr).split())
+
+    def get(self, object_id, descr):
+        key = self.key(object_id, descr)
+        with self._lock:
+            name = self.entries.get(key)
+            if name is not None:
+                self.entries.move_to_end(key)
+            return name
+
+    def put(self, object_id, descr, name):
+        key = self.key(object_id, descr)
+        with self._lock:
+            self.entries[key] = name
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
 
 
 class SwitchFactory:
@@ -9,9 +45,13 @@ class SwitchFactory:
     Each subclass must implement sou_compatível(ifDescr) method.
     """
     @classmethod
-    def _type(cls, descr, classe):
-        """ Resolve the fittest subclass for this SNMP Switch through deep first. """
-        for switchClass in classe.__subclasses__():
+    def _type(cls, descr, classe, object_id=''):
+        """
+        Resolve the fittest subclass for this SNMP Switch through deep first. Under Switch, only the vendors matched by
+        the registry (switch/vendors.py) are tried.
+        """
+        subclasses = vendors.candidates(descr, object_id) if classe is Switch else classe.__subclasses__()
+        for switchClass in subclasses:
             logging.debug('    \\--> class: {}'.format(switchClass.__name__))
             if switchClass.is_compatible(descr):
                 ret = SwitchFactory._type(descr, switchClass)
@@ -20,28 +60,138 @@ class SwitchFactory:
                 return switchClass
         return classe
 
+    classified = ClassificationCache()
+
+    @classmethod
+    def _class_by_name(cls, name, classe=Switch):
+        if classe.__name__ == name:
+            return classe
+        if classe is Switch and not vendors.load_class(name):
+            return None
+        for switchClass in classe.__subclasses__():
+            found = cls._class_by_name(name, switchClass)
+            if found is not None:
+                return found
+        return None
+
+    # sysDescr, bridge MAC, sysUpTime and sysObjectID: what is needed to pick the class and check the device cache,
+    # in one GET
+    _oids_identity = (Switch._oids_geral['descr'], Switch._oids_geral['mac'], Switch._oids_geral['uptime'],
+                      '.1.3.6.1.2.1.1.2.0')
+
+    @classmethod
+    def _classify(cls, descr, object_id):
+        """ Switch class for this description: from the classification cache, or found by _type() and then cached """
+        name = cls.classified.get(object_id, descr)
+        class_found = cls._class_by_name(name) if name else None
+        if class_found is None:
+            class_found = SwitchFactory._type(descr, Switch, object_id)
+            cls.classified.put(object_id, descr, class_found.__name__)
+        return class_found
+
     @classmethod
-    def factory(cls, host, community='public', version=2):
+    def _resolve(cls, values, cache):
+        """
+        :param values: answer of the _oids_identity GET
+        :param cache: DeviceCache or None
+        :return: (Switch class/subclass, DeviceCache entry or None, sysObjectID)
+        """
+        descr, mac, uptime, object_id = snmp_values(values)
+        entry = None
+        if cache is not None and values[2][TYPE] == 'Timeticks':
+            entry = cache.get(format_mac(mac), descr, uptime_ms(uptime))
+        object_id = object_id if values[3][TYPE] == 'OBJECTID' else ''
+        class_found = cls._class_by_name(entry['class']) if entry else None
+        if class_found is None:
+            entry = None
+            class_found = cls._classify(descr, object_id)
+        return class_found, entry, object_id
+
+    @classmethod
+    def factory(cls, host, community='public', version=2, cache=None):
         """
         Get new instance of Switch class or subclass based on the switch SNMP description field.
         :param host: IP of a switch
         :param community: snmp community
         :param version: 2. Only change this if you switch only supports SNMP version 1
-        :return: new instance of Switch class/subclass
+        :param cache: DeviceCache. When the switch is there (and didn't reboot since), the new instance reuses the
+        cached class, baseport map and inventory data.
+        :return: new instance of Switch class/subclass. Its SNMP session (shared with this one through the pool)
+        is given back with close().
         """
+        snmp_con = None
         try:
-            # if host is str:
-            if isinstance(host, str):
-                #snmp_con = SNMP(host, community)
-                snmp_con = SnmpFactory.factory(host, community)
-                snmp_con.start()
-            else:
-                snmp_con = host
-            descr = Switch.online_description(snmp_con)
-        except SNMPError as e:
+            try:
+                # if host is str:
+                if isinstance(host, str):
+                    snmp_con = pool.acquire(host, community, version)
+                    values = snmp_con.get(cls._oids_identity)
+                else:
+                    values = host.get(cls._oids_identity)
+                class_found, entry, object_id = cls._resolve(values, cache)
+            except SNMPError as e:
+                raise
+            except Exception as e:
+                raise Exception("FACTORY: Error with description: {}".format(e))
+            # the new instance takes the same session from the pool
+            obj = class_found(host, community, version)
+        finally:
+            if snmp_con is not None:
+                pool.release(snmp_con)
+        obj.object_id = object_id
+        if entry:
+            obj.restore_cache(entry)
+        return obj
+
+
+    @staticmethod
+    async def _in_executor(loop, executor, dispose, func, *args):
+        """
+        run_in_executor() for calls whose result must be given back (a pooled session, a Switch holding one).
+        If the caller is cancelled (deadline) while func is still running in the executor, the result is handed
+        to dispose() as soon as it is ready instead of being lost.
+        """
+        done = Future()
+
+        def call():
+            try:
+                done.set_result(func(*args))
+            except BaseException as e:
+                done.set_exception(e)
+            return done.result()
+
+        try:
+            return await loop.run_in_executor(executor, call)
+        except asyncio.CancelledError:
+            # runs now if func already returned, else in the executor thread when it does
+            done.add_done_callback(lambda f: f.exception() is None and dispose(f.result()))
             raise
-        except Exception as e:
-            raise Exception("FACTORY: Error with description: {}".format(e))
-        class_found = SwitchFactory._type(descr, Switch)
-        return class_found(host, community, version)
 
+    @classmethod
+    async def factory_async(cls, host, community='public', version=2, executor=None, cache=None):
+        """
+        asyncio version of factory(). The session is taken from the pool, and the description and the new instance
+        are read / built inside the executor.
+        :param executor: concurrent.futures executor used for the blocking SNMP calls. None uses the loop default.
+        :param cache: DeviceCache, as in factory()
+        :return: new instance of Switch class/subclass
+        """
+        loop = asyncio.get_running_loop()
+        snmp_con = None
+        try:
+            try:
+                snmp_con = await cls._in_executor(loop, executor, pool.release, pool.acquire, host, community, version)
+                class_found, entry, object_id = cls._resolve(await loop.run_in_executor(executor, snmp_con.get,
+                                                                             cls._oids_identity), cache)
+            except SNMPError as e:
+                raise
+            except Exception as e:
+                raise Exception("FACTORY: Error with description: {}".format(e))
+            obj = await cls._in_executor(loop, executor, class_found.close, class_found, host, community, version)
+        finally:
+            if snmp_con is not None:
+                pool.release(snmp_con)
+        obj.object_id = object_id
+        if entry:
+            obj.restore_cache(entry)
+        return obj
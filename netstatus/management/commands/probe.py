@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from netstatus.lib.probe import probe_update_db, probe_update_host
+from netstatus.lib.switch.Switch import Switch
+
+
+class Command(BaseCommand):
+    help = 'Probe the active switches of the database (or one host) through SNMP and save their state.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('host', nargs='?', default='', help='probe only this switch instead of the database ones')
+        parser.add_argument('community', nargs='?', default='public')
+        parser.add_argument('--profile', default='full', choices=sorted(Switch.load_profiles),
+                            help="what is loaded and saved, e.g. 'macs' for the fast mac table cycle")
+        parser.add_argument('--dryrun', action='store_true', help="don't save into the database")
+        parser.add_argument('--processes', type=int, default=None,
+                            help='split the database switches among N processes (default PROBE_PROCESSES)')
+
+    def handle(self, *args, **options):
+        if options['host']:
+            response = probe_update_host(options['host'], options['community'], options['dryrun'], options['profile'])
+        else:
+            response = probe_update_db(options['dryrun'], options['profile'], options['processes'])
+        if response is None:
+            raise CommandError('no switch was probed')
+        for msg in response.all:
+            self.stdout.write(str(msg))
+        for host, msgs in response.hosts.items():
+            self.stdout.write('-- {}'.format(host))
+            for msg in msgs:
+                self.stdout.write('   {}'.format(msg))
@@ -0,0 +1,33 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from netstatus.lib.probed import ProbeDaemon
+
+
+class Command(BaseCommand):
+    help = 'Keep probing the active switches of the database, each one at the interval of each load profile ' \
+           '(Settings.PROBED_INTERVALS).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dryrun', action='store_true', help="don't save into the database")
+        parser.add_argument('--verbose', action='store_true', help='print the messages of every switch')
+
+    def handle(self, *args, **options):
+        verbose = options['verbose']
+
+        def output(profile, response):
+            self.stdout.write('== {} ({} switches)'.format(profile, len(response.hosts)))
+            for msg in response.all:
+                self.stdout.write(str(msg))
+            for host, msgs in response.hosts.items() if verbose else ():
+                self.stdout.write('-- {}'.format(host))
+                for msg in msgs:
+                    self.stdout.write('   {}'.format(msg))
+
+        daemon = ProbeDaemon(dryrun=options['dryrun'], output=output)
+        signal.signal(signal.SIGTERM, lambda signum, frame: daemon.stop())
+        try:
+            daemon.run()
+        except KeyboardInterrupt:
+            pass
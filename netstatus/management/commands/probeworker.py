@@ -0,0 +1,42 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from netstatus.lib.jobqueue import ProbeWorker
+
+
+class Command(BaseCommand):
+    help = 'Probe the switches of the probe_job table. Run as many workers as you like, on any host, against the ' \
+           'same PostgreSQL database: each job is claimed by only one of them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owner', default=None, help='name of this worker in the leases (default hostname:pid)')
+        parser.add_argument('--batch', type=int, default=None, help='jobs claimed at once (default PROBE_CONCURRENCY)')
+        parser.add_argument('--once', action='store_true', help='probe one batch and exit')
+        parser.add_argument('--dryrun', action='store_true', help="don't save the switches into the database")
+        parser.add_argument('--verbose', action='store_true', help='print the messages of every switch')
+
+    def handle(self, *args, **options):
+        verbose = options['verbose']
+
+        def output(profile, response):
+            self.stdout.write('== {} ({} switches)'.format(profile, len(response.hosts)))
+            for msg in response.all:
+                self.stdout.write(str(msg))
+            for host, msgs in response.hosts.items() if verbose else ():
+                self.stdout.write('-- {}'.format(host))
+                for msg in msgs:
+                    self.stdout.write('   {}'.format(msg))
+
+        worker = ProbeWorker(options['owner'], options['batch'], options['dryrun'], output)
+        if options['once']:
+            try:
+                worker.run_once()
+            finally:
+                worker.close()
+            return
+        signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+        try:
+            worker.run()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='switches',
+            name='snmp_max_repetitions',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 2.2.28 on 2026-10-18 15:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0002_switches_snmp_max_repetitions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProbeJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('profile', models.CharField(default='full', max_length=10)),
+                ('due', models.DateTimeField(db_index=True)),
+                ('lease_owner', models.CharField(blank=True, max_length=80, null=True)),
+                ('lease_until', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.SmallIntegerField(default=0)),
+                ('last_error', models.CharField(blank=True, default='', max_length=200)),
+                ('switch', models.ForeignKey(db_column='switch', on_delete=django.db.models.deletion.CASCADE, related_name='probe_jobs', to='netstatus.Switches')),
+            ],
+            options={
+                'db_table': 'probe_job',
+                'managed': True,
+                'unique_together': {('switch', 'profile')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0003_probejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='switches',
+            name='probe_deadline',
+            field=models.SmallIntegerField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 18:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0004_switches_probe_deadline'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='switches',
+            name='probe_failures',
+            field=models.SmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='switches',
+            name='probe_last_success',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='switches',
+            name='probe_next_attempt',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
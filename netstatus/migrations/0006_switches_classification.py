@@ -0,0 +1,28 @@
+# Generated by Django 2.2.28 on 2026-10-18 19:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0005_switches_probe_health'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='switches',
+            name='sys_object_id',
+            field=models.CharField(blank=True, max_length=128, null=True),
+        ),
+        migrations.AddField(
+            model_name='switches',
+            name='sys_descr',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='switches',
+            name='switch_class',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.2.28 on 2026-10-18 21:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0006_switches_classification'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='switches',
+            name='ports_full_load',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
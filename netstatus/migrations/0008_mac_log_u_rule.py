@@ -0,0 +1,44 @@
+# Generated by Django 2.2.28 on 2026-10-18 23:10
+
+from django.db import migrations
+
+# same rule as snmpswitch-functions.sql, for the databases created before it
+MAC_LOG_U = """
+CREATE OR REPLACE RULE mac_log_u AS
+    ON UPDATE TO public.mac
+    WHERE old.port <> new.port OR old.ip IS DISTINCT FROM new.ip
+    DO  INSERT INTO public.mac_log (switch, mac, port, vlan, ip, data, tstamp)  SELECT old.switch,
+            old.mac,
+            old.port,
+            old.vlan,
+            old.ip,
+            old.data,
+            now() AS now;
+"""
+
+
+def _has_mac_log(schema_editor):
+    # mac_log only exists in the databases created by snmpswitch-functions.sql (PostgreSQL)
+    connection = schema_editor.connection
+    return connection.vendor == 'postgresql' and 'mac_log' in connection.introspection.table_names()
+
+
+def create_rule(apps, schema_editor):
+    if _has_mac_log(schema_editor):
+        schema_editor.execute(MAC_LOG_U)
+
+
+def drop_rule(apps, schema_editor):
+    if _has_mac_log(schema_editor):
+        schema_editor.execute('DROP RULE IF EXISTS mac_log_u ON public.mac')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('netstatus', '0007_switches_ports_full_load'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_rule, drop_rule),
+    ]
@@ -71,6 +71,20 @@ class Switches(models.Model):
     community_rw = models.CharField(max_length=20)
     uptime = models.DurationField(default=0)
     last_update = models.DateTimeField(auto_now=True)
+    # GETBULK max-repetitions for this switch. Null uses the switch class / Settings default.
+    snmp_max_repetitions = models.SmallIntegerField(blank=True, null=True)
+    # seconds given to the probe of this switch. Null uses Settings.PROBE_DEADLINE, 0 means no limit.
+    probe_deadline = models.SmallIntegerField(blank=True, null=True)
+    # health of the probe: consecutive failures, and when it may be probed again (back-off). See lib/probe.py
+    probe_failures = models.SmallIntegerField(default=0)
+    probe_last_success = models.DateTimeField(blank=True, null=True)
+    probe_next_attempt = models.DateTimeField(blank=True, null=True)
+    # identity read by SwitchFactory and the Switch class it picked, reused by the next probes. See lib/switchfactory.py
+    sys_object_id = models.CharField(max_length=128, blank=True, null=True)
+    sys_descr = models.TextField(blank=True, null=True)
+    switch_class = models.CharField(max_length=40, blank=True, null=True)
+    # last load of the whole configuration of the ports (not incremental). See Settings.PROBE_FULL_LOAD_AGE
+    ports_full_load = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         managed = True
@@ -123,6 +137,23 @@ class SwitchesNeighbors(models.Model):
         unique_together = (('mac1', 'port1', 'mac2'),)
 
 
+class ProbeJob(models.Model):
+    # one row per switch and load profile, claimed by the probeworker processes (netstatus/lib/jobqueue.py)
+    switch = models.ForeignKey(Switches, models.CASCADE, db_column='switch', related_name='probe_jobs')
+    profile = models.CharField(max_length=10, default='full')
+    due = models.DateTimeField(db_index=True)
+    # worker holding the job until lease_until. An expired lease (dead worker) can be claimed again.
+    lease_owner = models.CharField(max_length=80, blank=True, null=True)
+    lease_until = models.DateTimeField(blank=True, null=True)
+    attempts = models.SmallIntegerField(default=0)
+    last_error = models.CharField(max_length=200, blank=True, default='')
+
+    class Meta:
+        managed = True
+        db_table = 'probe_job'
+        unique_together = (('switch', 'profile'),)
+
+
 class Surveillance(models.Model):
     mac = models.CharField(unique=True, max_length=17, primary_key=True)
     type = models.TextField(db_column='type')  # This field type is a guess.
@@ -13,5 +13,74 @@ class Settings:
     # two chars from name.
     SWITCH_ALIAS = lambda name: name[:3] + '-' + name[-2:] \
         if 'SWITCH_ALIAS' not in os.environ else eval(os.environ['SWITCH_ALIAS'])
+    # how many switches are probed at the same time by the probe scheduler (netstatus.lib.scheduler).
+    PROBE_CONCURRENCY = 32 \
+        if 'PROBE_CONCURRENCY' not in os.environ else int(os.environ['PROBE_CONCURRENCY'])
+    # max-repetitions of each GETBULK request used by SNMP.walk() (SNMPv2c). 0 disables GETBULK, walking with GETNEXT.
+    # Switch subclasses (_max_repetitions) and switches rows (snmp_max_repetitions) may change this value.
+    SNMP_MAX_REPETITIONS = 25 \
+        if 'SNMP_MAX_REPETITIONS' not in os.environ else int(os.environ['SNMP_MAX_REPETITIONS'])
+    # initial number of OIDs packed in each GET PDU by SNMP.get(). Lowered per device when the agent answers tooBig.
+    SNMP_MAX_VARBINDS = 40 \
+        if 'SNMP_MAX_VARBINDS' not in os.environ else int(os.environ['SNMP_MAX_VARBINDS'])
+    # seconds an SNMP session without users stays open in netstatus.lib.snmp.SessionPool, waiting for the next probe
+    SNMP_SESSION_IDLE = 600 \
+        if 'SNMP_SESSION_IDLE' not in os.environ else int(os.environ['SNMP_SESSION_IDLE'])
+    # JSON file where netstatus.lib.devicecache.DeviceCache keeps slow changing data of each switch between probes
+    # (Switch subclass, baseport map, serial, ...). Empty string disables the cache.
+    DEVICE_CACHE = '/var/tmp/netstatus-devices.json' \
+        if 'DEVICE_CACHE' not in os.environ else os.environ['DEVICE_CACHE']
+    # how many (sysObjectID, sysDescr) -> Switch class answers SwitchFactory keeps in memory (LRU). The class of each
+    # switch is also saved in the switches table.
+    CLASSIFICATION_CACHE_SIZE = 1024 \
+        if 'CLASSIFICATION_CACHE_SIZE' not in os.environ else int(os.environ['CLASSIFICATION_CACHE_SIZE'])
+    # probe_update_db reads again only the ports whose ifLastChange differs from the database (plus the counters of
+    # every port). Changes that don't affect the link (vlans, PoE, alias) wait for a full load: set 0 to always do it.
+    PROBE_INCREMENTAL = 1 \
+        if 'PROBE_INCREMENTAL' not in os.environ else int(os.environ['PROBE_INCREMENTAL'])
+    # seconds after the last full load of the ports of a switch when the next probe loads all of them again, so the
+    # changes that don't affect the link are seen at least this often.
+    PROBE_FULL_LOAD_AGE = 86400 \
+        if 'PROBE_FULL_LOAD_AGE' not in os.environ else int(os.environ['PROBE_FULL_LOAD_AGE'])
+    # probe_update_db saves each switch as soon as it is loaded. PROBE_WRITERS tasks write to the database, each with
+    # its own connection; up to PROBE_QUEUE_SIZE loaded switches may wait for them.
+    PROBE_WRITERS = 1 \
+        if 'PROBE_WRITERS' not in os.environ else int(os.environ['PROBE_WRITERS'])
+    PROBE_QUEUE_SIZE = 8 \
+        if 'PROBE_QUEUE_SIZE' not in os.environ else int(os.environ['PROBE_QUEUE_SIZE'])
+    # seconds given to the probe of each switch (switches.probe_deadline may change it). When they run out, its SNMP
+    # session is cancelled and nothing is saved. 0 = no limit.
+    PROBE_DEADLINE = 300 \
+        if 'PROBE_DEADLINE' not in os.environ else int(os.environ['PROBE_DEADLINE'])
+    # a switch that can't be probed waits PROBE_BACKOFF seconds before the next attempt, doubled after each failure up
+    # to PROBE_BACKOFF_MAX. Then it must answer a single GET in PROBE_LIVENESS_TIMEOUT seconds before a full probe.
+    PROBE_BACKOFF = 300 \
+        if 'PROBE_BACKOFF' not in os.environ else int(os.environ['PROBE_BACKOFF'])
+    PROBE_BACKOFF_MAX = 21600 \
+        if 'PROBE_BACKOFF_MAX' not in os.environ else int(os.environ['PROBE_BACKOFF_MAX'])
+    PROBE_LIVENESS_TIMEOUT = 2 \
+        if 'PROBE_LIVENESS_TIMEOUT' not in os.environ else int(os.environ['PROBE_LIVENESS_TIMEOUT'])
+    # probe_update_db splits the switches among PROBE_PROCESSES processes (1 probes all of them in this one)
+    PROBE_PROCESSES = 1 \
+        if 'PROBE_PROCESSES' not in os.environ else int(os.environ['PROBE_PROCESSES'])
+    # manage.py probed: seconds between two probes of each switch, per load profile (0 disables the profile). Each
+    # interval varies by PROBED_JITTER percent, and the active switches are read again every PROBED_REFRESH seconds.
+    PROBED_INTERVALS = {
+        'full': 3600 if 'PROBED_INTERVAL_FULL' not in os.environ else int(os.environ['PROBED_INTERVAL_FULL']),
+        'macs': 300 if 'PROBED_INTERVAL_MACS' not in os.environ else int(os.environ['PROBED_INTERVAL_MACS']),
+    }
+    PROBED_JITTER = 10 \
+        if 'PROBED_JITTER' not in os.environ else int(os.environ['PROBED_JITTER'])
+    PROBED_REFRESH = 600 \
+        if 'PROBED_REFRESH' not in os.environ else int(os.environ['PROBED_REFRESH'])
+    # manage.py probeworker: the jobs of the probe_job table are held for PROBE_JOB_LEASE seconds by the worker that
+    # claimed them. A failed probe is retried after PROBE_JOB_RETRY seconds (doubled each time), up to
+    # PROBE_JOB_ATTEMPTS times, and then waits for the next interval of PROBED_INTERVALS.
+    PROBE_JOB_LEASE = 900 \
+        if 'PROBE_JOB_LEASE' not in os.environ else int(os.environ['PROBE_JOB_LEASE'])
+    PROBE_JOB_RETRY = 60 \
+        if 'PROBE_JOB_RETRY' not in os.environ else int(os.environ['PROBE_JOB_RETRY'])
+    PROBE_JOB_ATTEMPTS = 3 \
+        if 'PROBE_JOB_ATTEMPTS' not in os.environ else int(os.environ['PROBE_JOB_ATTEMPTS'])
     DEBUG = False
     #DEBUG = True
@@ -2,14 +2,23 @@ import os
 import unittest
 from unittest import mock
 
-from netsnmp._api import SNMPError
+from django.db import connection
+from django.test import TransactionTestCase
 from django.test.client import RequestFactory
 
-from netstatus.lib.switch import switchlib, Switch
+from netstatus.lib.switch import switchlib, vendors, Switch
 from netstatus.lib.switch.SwitchHH3C import SwitchHH3C
+from netstatus.models import Mac, ProbeJob, Switches, SwitchesNeighbors, SwitchesPorts
 from netstatus.settings import Settings
-from netstatus.lib.snmp import PseudoSnmp, SnmpFactory
-from netstatus.lib.switchfactory import SwitchFactory
+from netstatus.lib.devicecache import DeviceCache
+from netstatus.lib.probe import CoreIndex, ProbeResponse, _alive, _load_host, _switch_status, \
+    _switch_status_sharded, backoff
+from netstatus.lib.probed import ProbeDaemon
+from netstatus.lib.jobqueue import claim, finish, next_due, schedule
+from netstatus.lib import persist
+from netstatus.lib.scheduler import ProbeScheduler
+from netstatus.lib.snmp import SNMP, PseudoSnmp, SnmpFactory, SNMPCancelled, SNMPError, SessionPool
+from netstatus.lib.switchfactory import ClassificationCache, SwitchFactory
 from netstatus.lib.switch.switchlib import *
 from netstatus.views.probe import *
 
@@ -77,6 +86,323 @@ class TestSwitch(unittest.TestCase):
         switch = SwitchFactory._type(descr, Switch.Switch)
         self.assertEqual(switch.__name__, 'SwitchExtremeX440')
 
+    def test_vendor_registry(self):
+        descr = 'Cisco IOS Software, C2960X Software (C2960X-UNIVERSALK9-M), Version 15.2(7)E3'
+        self.assertEqual(vendors.candidates(descr), [])
+        self.assertIs(SwitchFactory._type(descr, Switch.Switch), Switch.Switch)
+        self.assertEqual([c.__name__ for c in vendors.candidates('DGS-3420-28PC Gigabit Ethernet Switch')],
+                         ['SwitchDLINK'])
+        self.assertEqual([c.__name__ for c in vendors.candidates('S5720-28X', '.1.3.6.1.4.1.2011.2.23.1')],
+                         ['SwitchHuawei'])
+        self.assertEqual(SwitchFactory._class_by_name('SwitchHuaweiS5700').__name__, 'SwitchHuaweiS5700')
+        self.assertIsNone(SwitchFactory._class_by_name('SwitchCisco'))
+
+
+    def test_load_profiles(self):
+        switch = SwitchHH3C('')
+        for profile, phases in switch.load_profiles.items():
+            self.assertEqual(phases[0], 'get_geral', 'get_geral must be the first phase of {}'.format(profile))
+            self.assertEqual([p.__name__ for p in switch._load_phases(profile)], list(phases))
+        switch._load_phases('macs')
+        self.assertTrue(switch.loaded('get_mac_list'))
+        self.assertFalse(switch.loaded('get_ports'))
+        self.assertRaises(ValueError, switch.load, 'nothing')
+
+    def test_mac_table(self):
+        macs = MacTable()
+        macs.append(10, 0x000101010101, 2)
+        macs.append(4000, 0xa0b1c2d3e4f5, 4094)
+        self.assertEqual(len(macs), 2)
+        self.assertEqual(macs[1], (4000, 'a0:b1:c2:d3:e4:f5', 4094))
+        self.assertEqual(list(macs), [(10, '00:01:01:01:01:01', 2), (4000, 'a0:b1:c2:d3:e4:f5', 4094)])
+        self.assertEqual(list(macs.raw())[0], (10, 0x000101010101, 2))
+
+    def test_device_cache(self):
+        import tempfile
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'devices.json')
+            cache = DeviceCache(path)
+            entry = {'class': 'SwitchHH3C', 'descr': 'HPE 5130', 'uptime': 1000.0, 'baseport': {1: 1, 2: 2},
+                     'physical': '', 'soft_version': '', 'serial': 'CN123', 'vendor': 'HPE', 'model': 'JG977A'}
+            cache.put('00:01:02:03:04:05', entry)
+            cache.save()
+            cache = DeviceCache(path)
+            self.assertEqual(cache.get('00:01:02:03:04:05', 'HPE 5130', 2000.0)['serial'], 'CN123')
+            # rebooted
+            self.assertIsNone(cache.get('00:01:02:03:04:05', 'HPE 5130', 10.0))
+            self.assertIsNone(cache.get('00:01:02:03:04:05', 'HPE 5130', 2000.0))
+
+            cache.put('00:01:02:03:04:05', entry)
+            self.assertIsNone(cache.get('00:01:02:03:04:05', 'HPE 5130 new firmware', 2000.0))
+
+            # two processes saving the same file: the entries of both are kept
+            first, second = DeviceCache(path), DeviceCache(path)
+            first.put('00:00:00:00:00:01', entry)
+            second.put('00:00:00:00:00:02', entry)
+            first.save()
+            second.save()
+            self.assertEqual(sorted(DeviceCache(path).entries),
+                             ['00:00:00:00:00:01', '00:00:00:00:00:02', '00:01:02:03:04:05'])
+
+        switch = SwitchHH3C('')
+        switch.restore_cache(entry)
+        self.assertEqual(switch._map_baseport_ifindex, {1: 1, 2: 2})
+        self.assertEqual(switch.serial, 'CN123')
+
+    def test_classification_cache(self):
+        cache = ClassificationCache(size=2)
+        cache.put('.1.3.6.1.4.1.25506.11.1.136', 'HPE 5130  24G\r\nSwitch', 'SwitchHH3C')
+        self.assertEqual(cache.get('.1.3.6.1.4.1.25506.11.1.136', 'HPE 5130 24G Switch'), 'SwitchHH3C')
+        self.assertIsNone(cache.get('', 'HPE 5130 24G Switch'))
+        cache.put('', 'a', 'Switch')
+        cache.put('', 'b', 'Switch')
+        self.assertIsNone(cache.get('.1.3.6.1.4.1.25506.11.1.136', 'HPE 5130 24G Switch'))
+
+        descr = 'DGS-3420-28PC Gigabit Ethernet Switch'
+        with mock.patch.object(SwitchFactory, 'classified', ClassificationCache()):
+            self.assertEqual(SwitchFactory._classify(descr, '.1.3.6.1.4.1.171.10.119.2').__name__, 'SwitchDLINK')
+            # memoised: _type() isn't called again
+            with mock.patch.object(SwitchFactory, '_type', side_effect=AssertionError):
+                self.assertEqual(SwitchFactory._classify(descr, '.1.3.6.1.4.1.171.10.119.2').__name__,
+                                 'SwitchDLINK')
+                # class saved in the switches table
+                SwitchFactory.classified.put('', descr, 'SwitchHH3C')
+                self.assertEqual(SwitchFactory._classify(descr, '').__name__, 'SwitchHH3C')
+
+    def test_probe_pipeline(self):
+        import asyncio
+        index = CoreIndex(['core'])
+        saved = []
+
+        async def load(executor, host, delay):
+            await asyncio.sleep(delay)
+            if host == 'core':
+                index.set(host, {'00:01:02:03:04:05': '10.0.0.1'})
+            index.done(host)
+            return None if host == 'fail' else host
+
+        async def write(host):
+            # the switches loaded before the core must wait for its ip_mac
+            saved.append((host, await index.wait()))
+
+        jobs = [(load, 'sw1', 0), (load, 'fail', 0), (load, 'sw2', 0.01), (load, 'core', 0.05)]
+        results = ProbeScheduler(concurrency=2, writers=2, queue_size=1).run(jobs, write)
+        self.assertEqual(results, [None] * 4)
+        self.assertEqual(sorted(h for h, _ in saved), ['core', 'sw1', 'sw2'])
+        self.assertTrue(all(ip_mac == {'00:01:02:03:04:05': '10.0.0.1'} for _, ip_mac in saved))
+
+        # the core failed: the relation saved by the last probes is read only once
+        calls = []
+
+        async def known_ip_mac():
+            calls.append(1)
+            return {'00:01:02:03:04:05': '10.0.0.2'}
+
+        index = CoreIndex(['fail'], known_ip_mac)
+        saved.clear()
+        ProbeScheduler(concurrency=2).run([(load, 'fail', 0.01), (load, 'sw1', 0), (load, 'sw2', 0)], write)
+        self.assertEqual(sorted(saved), [('sw1', {'00:01:02:03:04:05': '10.0.0.2'}),
+                                         ('sw2', {'00:01:02:03:04:05': '10.0.0.2'})])
+        self.assertEqual(len(calls), 1)
+
+    def test_probe_daemon(self):
+        rows = [('10.0.0.2', 1, 'public', 2, None, None), ('10.0.0.1', 0, 'public', 1, None, None)]
+        daemon = ProbeDaemon(intervals={'full': 100, 'macs': 10, 'config': 0}, jitter=10, dryrun=True)
+        with mock.patch('netstatus.lib.probe.active_switches', return_value=rows):
+            daemon.refresh(0)
+        self.assertEqual(len(daemon.queue), 4)
+        self.assertTrue(all(0 <= due <= (100 if profile == 'full' else 10) for due, _, _, profile in daemon.queue))
+
+        batches = daemon.pop_due(100)
+        self.assertEqual(sorted(batches), ['full', 'macs'])
+        self.assertEqual(sorted(row[0] for row in batches['macs']), ['10.0.0.1', '10.0.0.2'])
+        # the core switch goes first when due at the same time
+        self.assertEqual({host for _, priority, host, _ in daemon.queue if not priority}, {'10.0.0.1'})
+        self.assertEqual(len(daemon.queue), 4)
+        self.assertTrue(all(109 <= due <= 211 for due, _, _, _ in daemon.queue))
+
+        # removed from the database: dropped when due
+        daemon.rows.pop('10.0.0.2')
+        daemon.pop_due(300)
+        self.assertEqual({host for _, _, host, _ in daemon.queue}, {'10.0.0.1'})
+
+    def test_probe_job_due(self):
+        from datetime import datetime, timedelta
+        now = datetime(2020, 1, 1)
+        intervals = {'full': 1000, 'macs': 100}
+        self.assertTrue(timedelta(seconds=900) <= next_due('full', now, 1, True, intervals, 10) - now
+                        <= timedelta(seconds=1100))
+        # failures are retried sooner, doubling the wait, until PROBE_JOB_ATTEMPTS
+        self.assertEqual(next_due('full', now, 1, False, intervals) - now, timedelta(seconds=Settings.PROBE_JOB_RETRY))
+        self.assertEqual(next_due('full', now, 2, False, intervals) - now,
+                         timedelta(seconds=2 * Settings.PROBE_JOB_RETRY))
+        self.assertEqual(next_due('macs', now, Settings.PROBE_JOB_ATTEMPTS, False, intervals, 0) - now,
+                         timedelta(seconds=100))
+
+    def test_session_pool(self):
+        def factory(host, community='public', version=2, asynchronous=False):
+            return mock.Mock(cancelled=False)
+
+        with mock.patch.object(SnmpFactory, 'factory', side_effect=factory) as opened:
+            pool = SessionPool(idle=60)
+            session = pool.acquire('10.0.0.1')
+            self.assertIs(pool.acquire('10.0.0.1'), session)
+            self.assertIsNot(pool.acquire('10.0.0.1', 'private'), session)
+            self.assertEqual(opened.call_count, 2)
+            session.start.assert_called_once_with()
+            # kept open between probes, with the PDU size learned by the last one dropped
+            session.max_varbinds = 5
+            pool.release(session)
+            pool.release(session)
+            self.assertIs(pool.acquire('10.0.0.1'), session)
+            self.assertEqual(session.max_varbinds, Settings.SNMP_MAX_VARBINDS)
+            session.close.assert_not_called()
+            # a cancelled session isn't given again
+            session.cancelled = True
+            pool.release(session)
+            self.assertIsNot(pool.acquire('10.0.0.1'), session)
+
+            pool = SessionPool(idle=0)
+            session = pool.acquire('10.0.0.1')
+            pool.release(session)
+            session.close.assert_called_once_with()
+
+            # two threads opening the same key at once: both get the first session, the other one is closed
+            pool = SessionPool(idle=60)
+            first, loser = factory('10.0.0.2'), factory('10.0.0.2')
+
+            def racing(*args, **kwargs):
+                pool._sessions[('10.0.0.2', 'public', 2)] = [first, 1, None]
+                return loser
+            opened.side_effect = racing
+            self.assertIs(pool.acquire('10.0.0.2'), first)
+            self.assertEqual(pool._sessions[('10.0.0.2', 'public', 2)][1], 2)
+            loser.close.assert_called_once_with()
+
+    def test_get_generr(self):
+        session = SNMP('10.0.0.1')
+        oids = ['.1.3.6.1.2.1.1.{}.0'.format(i) for i in range(1, 9)]
+        bad = '.1.3.6.1.2.1.1.9.0'
+
+        def bad_oid(pdu):
+            if bad in pdu:
+                raise SNMPError('genErr')
+            return [(oid, 'INTEGER', '1') for oid in pdu]
+
+        def small_agent(pdu):
+            if len(pdu) > 4:
+                raise SNMPError('genErr')
+            return [(oid, 'INTEGER', '1') for oid in pdu]
+
+        # one OID the agent can't answer: raised, without lowering the PDU size
+        with mock.patch.object(session, '_get', side_effect=bad_oid):
+            self.assertRaises(SNMPError, session.get, oids + [bad])
+        self.assertEqual(session.max_varbinds, Settings.SNMP_MAX_VARBINDS)
+        # an agent failing big PDUs: the halves are answered and the smaller size is kept
+        with mock.patch.object(session, '_get', side_effect=small_agent):
+            self.assertEqual([v[0] for v in session.get(oids)], oids)
+        self.assertEqual(session.max_varbinds, 4)
+
+    def test_probe_backoff(self):
+        self.assertEqual(backoff(1), Settings.PROBE_BACKOFF)
+        self.assertEqual(backoff(3), 4 * Settings.PROBE_BACKOFF)
+        self.assertEqual(backoff(100), Settings.PROBE_BACKOFF_MAX)
+
+    def test_probe_shards(self):
+        from concurrent.futures import ThreadPoolExecutor
+        calls = []
+
+        def status(rows, dryrun, profile, ip_mac=None):
+            calls.append(([row[0] for row in rows], ip_mac))
+            part = ProbeResponse(rows)
+            part.add_all('{} switches'.format(len(rows)))
+            part.saved = [row[0] for row in rows if row[0] not in ('10.0.0.4', '10.0.0.5')]
+            part.deadlines = {row[0]: 'get_mac_list' for row in rows if row[0] == '10.0.0.4'}
+            part.skipped = [row[0] for row in rows if row[0] == '10.0.0.5']
+            part.ip_mac = {'aa': '10.0.1.1'} if rows[0][1] == 0 else None
+            return part
+
+        rows = [['10.0.0.{}'.format(i), 0 if i == 1 else 1, 'public', i, None, None] for i in range(1, 6)]
+        # threads instead of processes, so the patched _switch_status is seen by the shards
+        with mock.patch('netstatus.lib.probe._switch_status', side_effect=status), \
+                mock.patch('netstatus.lib.probe.ProcessPoolExecutor', ThreadPoolExecutor):
+            response = _switch_status_sharded(rows, False, 'full', 2)
+        # the core first, alone, then the others split among the shards with its ARP table
+        self.assertEqual(calls[0], (['10.0.0.1'], None))
+        self.assertEqual(sorted(calls[1:]), [(['10.0.0.2', '10.0.0.4'], {'aa': '10.0.1.1'}),
+                                             (['10.0.0.3', '10.0.0.5'], {'aa': '10.0.1.1'})])
+        self.assertEqual(sorted(response.saved), ['10.0.0.1', '10.0.0.2', '10.0.0.3'])
+        self.assertEqual(response.deadlines, {'10.0.0.4': 'get_mac_list'})
+        self.assertEqual(response.skipped, ['10.0.0.5'])
+        self.assertEqual(sorted(response.hosts), [row[0] for row in rows])
+        self.assertIn('core: 1 switches', response.all)
+        self.assertIn('shard 1: 2 switches', response.all)
+        self.assertIn('Total of switches 5; Total of Switches Ok: 3; failures: 2; processes: 2', response.all)
+
+    def test_probe_alive(self):
+        with mock.patch('netstatus.lib.probe.SnmpFactory') as factory:
+            session = factory.factory.return_value
+            self.assertTrue(_alive('10.0.0.1', 'public'))
+            self.assertEqual((session.timeout, session.retries), (Settings.PROBE_LIVENESS_TIMEOUT, 0))
+            session.get.side_effect = SNMPError('timeout')
+            self.assertFalse(_alive('10.0.0.1', 'public'))
+        # the session is closed either way
+        self.assertEqual(session.close.call_count, 2)
+
+    def test_probe_deadline(self):
+        import asyncio
+        switch = mock.Mock(phase=None)
+
+        async def load_async(executor, profile):
+            switch.phase = 'get_mac_list'
+            await asyncio.sleep(1)
+        switch.load_async = load_async
+
+        response = ProbeResponse([['10.0.0.1']])
+        with mock.patch.object(SwitchFactory, 'factory_async', mock.AsyncMock(return_value=switch)):
+            self.assertIsNone(asyncio.run(_load_host(None, '10.0.0.1', 'public', 1, None, response, deadline=0.05)))
+        self.assertEqual(response.deadlines, {'10.0.0.1': 'get_mac_list'})
+        switch.sessao.cancel.assert_called_once_with()
+
+        # nothing more is sent after cancel() or the deadline
+        sessao = SNMP('10.0.0.1')
+        sessao.cancel()
+        self.assertRaises(SNMPCancelled, sessao.get, ['.1.3.6.1.2.1.1.1.0'])
+        sessao = SNMP('10.0.0.1')
+        sessao.deadline = 0
+        self.assertRaises(SNMPCancelled, sessao.walk, '.1.3.6.1.2.1.2.2.1.1')
+
+    def test_probe_deadline_in_factory(self):
+        # the deadline fires while the instance is still being built: it must be closed once ready
+        import asyncio
+        import threading
+        from concurrent.futures import ThreadPoolExecutor
+        built = threading.Event()
+        closed = threading.Event()
+
+        class Slow:
+            def __init__(self, host, community, version):
+                built.wait(1)
+
+            def close(self):
+                closed.set()
+
+        async def run(executor):
+            result = await _load_host(executor, '10.0.0.1', 'public', 1, None, response, deadline=0.05)
+            built.set()
+            return result
+
+        response = ProbeResponse([['10.0.0.1']])
+        session = mock.Mock()
+        session.get.return_value = []
+        with mock.patch('netstatus.lib.switchfactory.pool') as pool, \
+                mock.patch.object(SwitchFactory, '_resolve', return_value=(Slow, None, '')):
+            pool.acquire.return_value = session
+            with ThreadPoolExecutor(1) as executor:
+                self.assertIsNone(asyncio.run(run(executor)))
+            pool.release.assert_called_once_with(session)
+        self.assertEqual(response.deadlines, {'10.0.0.1': 'factory'})
+        self.assertTrue(closed.wait(1))
 
     def test_vlans_hh3c(self):
         switch = SwitchHH3C('')
@@ -116,6 +442,9 @@ class TestSwitch(unittest.TestCase):
                  }
         for i in range(1, 29):
             self.assertEqual(switch._vlans_ports(i), check[i], 'failed vlans for port {}'.format(i))
+        self.assertEqual(switch.vlan_ports('20'), ([24], [19]))
+        self.assertEqual(switch.vlan_ports('77'), ([19, 24], []))
+        self.assertEqual(switch.vlan_ports('999'), ([], []))
 
 
 class TestSwitchLoad(unittest.TestCase):
@@ -154,10 +483,10 @@ class TestSwitchLoad(unittest.TestCase):
 
         switch.get_vlans()
         self.assertEqual(switch.vlans, ('1', '2', '20', '77'))
-        self.assertEqual(switch.vtagged, {'1': (0, 0, 0, 0), '2': (255, 255, 251, 0),
-                                          '20': (0, 0, 128, 0), '77': (0, 0, 132, 0)})
-        self.assertEqual(switch.vuntagged, {'1': (255, 255, 251, 15), '2': (0, 0, 0, 0),
-                                            '20': (0, 0, 4, 0), '77': (0, 0, 0, 0)})
+        self.assertEqual(switch.vtagged, {'1': bytes((0, 0, 0, 0)), '2': bytes((255, 255, 251, 0)),
+                                          '20': bytes((0, 0, 128, 0)), '77': bytes((0, 0, 132, 0))})
+        self.assertEqual(switch.vuntagged, {'1': bytes((255, 255, 251, 15)), '2': bytes((0, 0, 0, 0)),
+                                            '20': bytes((0, 0, 4, 0)), '77': bytes((0, 0, 0, 0))})
 
         #self.assertEqual(switch._mask.__name__, 'mask_bigendian')
         self.assertEqual(switch._mask.__name__, 'mask_littleendian')
@@ -306,6 +635,65 @@ class TestSwitchLoad(unittest.TestCase):
         self.assertEqual(switch.macs[2], (10, '00:01:01:01:01:01', 2))
 
 
+    @unittest.skipUnless(os.path.isfile(PseudoSnmp.path + '/' + 'HPE-JG977A.snmpwalk'),
+                         'file HPE-JG977A.snmpwalk not found')
+    def test_bulkwalk(self):
+        session = PseudoSnmp('HPE-JG977A.snmpwalk')
+        session.start()
+        # GETBULK walk must bring the same rows as the plain walk, whatever the max-repetitions.
+        for oid in ('.1.3.6.1.2.1.17.7.1.2.2.1.2', '.1.3.6.1.2.1.2.2.1.3', '.1.3.6.1.2.1.17.1.4.1.2'):
+            for max_repetitions in (1, 7, 50):
+                self.assertEqual(session.bulkwalk(oid, max_repetitions), session.walk(oid),
+                                 'bulkwalk failed for {} with max-repetitions {}'.format(oid, max_repetitions))
+        self.assertEqual(session.bulkwalk('.1.3.6.1.4.1.99999'), [])
+
+    @unittest.skipUnless(os.path.isfile(PseudoSnmp.path + '/' + 'HPE-JG977A.snmpwalk'),
+                         'file HPE-JG977A.snmpwalk not found')
+    def test_get_split_toobig(self):
+        session = PseudoSnmp('HPE-JG977A.snmpwalk')
+        session.start()
+        oids = ['.1.3.6.1.2.1.2.2.1.2.{}'.format(i) for i in range(1, 29)]
+        expected = session.get(oids)
+        # an agent answering tooBig for more than 5 OIDs must give the same answer, only with smaller PDUs.
+        session.agent_max_varbinds = 5
+        self.assertEqual(session.get(oids), expected)
+        self.assertLessEqual(session.max_varbinds, 5)
+        self.assertEqual([v[OID] for v in expected], oids)
+
+    @unittest.skipUnless(os.path.isfile(PseudoSnmp.path + '/' + 'HPE-JG977A.snmpwalk'),
+                         'file HPE-JG977A.snmpwalk not found')
+    def test_ports_incremental(self):
+        session = PseudoSnmp('HPE-JG977A.snmpwalk')
+        session.start()
+        switch = SwitchFactory.factory(host=session)
+        switch.get_geral()
+        switch.get_vlans()
+        switch.get_ports()
+        previous = {k: dict(v) for k, v in switch.portas.items()}
+        # port 3 changed since the last probe, so its old alias must be replaced. The others are kept.
+        previous[3]['lastchange'] += 1
+        previous[3]['alias'] = 'old'
+        previous[5]['alias'] = 'kept'
+
+        incremental = SwitchFactory.factory(host=session)
+        incremental.set_previous(switch.uptime, previous)
+        incremental.get_geral()
+        incremental.get_vlans()
+        incremental.get_ports()
+        self.assertEqual(incremental.portas[3], switch.portas[3])
+        self.assertEqual(incremental.portas[5]['alias'], 'kept')
+        self.assertEqual(incremental.portas[5]['oct_in'], switch.portas[5]['oct_in'])
+        self.assertTrue(incremental.ports_incremental)
+
+        # rebooted: everything is loaded again
+        rebooted = SwitchFactory.factory(host=session)
+        rebooted.set_previous(switch.uptime + 1, previous)
+        rebooted.get_geral()
+        rebooted.get_vlans()
+        rebooted.get_ports()
+        self.assertEqual(rebooted.portas, switch.portas)
+        self.assertFalse(rebooted.ports_incremental)
+
     @unittest.skipUnless(os.path.isfile(PseudoSnmp.path + '/' + '3Com-3CR17771-91.snmpwalk'),
                          'file 3Com-3CR17771-91.snmpwalk not found')
     def test_load_hpe_a3600(self):
@@ -316,31 +704,31 @@ class TestSwitchLoad(unittest.TestCase):
         switch.get_geral()
         switch.get_vlans()
         self.assertEqual(switch.vlans, ('1', '10', '182', '2', '20', '202', '222', '242', '55', '77', '900', '998'))
-        self.assertEqual(switch.vtagged, {'1': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                          '10': (0, 64, 137, 15, 0, 0, 0, 0, 0),
-                                          '182': (0, 64, 137, 15, 0, 0, 0, 0, 0),
-                                          '2': (127, 191, 251, 15, 0, 0, 0, 0, 0),
-                                          '20': (0, 64, 201, 15, 0, 0, 0, 0, 0),
-                                          '202': (0, 64, 137, 15, 0, 0, 0, 0, 0),
-                                          '222': (0, 64, 137, 15, 0, 0, 0, 0, 0),
-                                          '242': (0, 64, 137, 15, 0, 0, 0, 0, 0),
-                                          '55': (0, 64, 201, 15, 0, 0, 0, 0, 0),
-                                          '77': (0, 64, 203, 15, 0, 0, 0, 0, 0),
-                                          '900': (0, 64, 137, 15, 0, 0, 0, 0, 0),
-                                          '998': (0, 64, 137, 15, 0, 0, 0, 0, 0),
+        self.assertEqual(switch.vtagged, {'1': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                          '10': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
+                                          '182': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
+                                          '2': bytes((127, 191, 251, 15, 0, 0, 0, 0, 0)),
+                                          '20': bytes((0, 64, 201, 15, 0, 0, 0, 0, 0)),
+                                          '202': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
+                                          '222': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
+                                          '242': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
+                                          '55': bytes((0, 64, 201, 15, 0, 0, 0, 0, 0)),
+                                          '77': bytes((0, 64, 203, 15, 0, 0, 0, 0, 0)),
+                                          '900': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
+                                          '998': bytes((0, 64, 137, 15, 0, 0, 0, 0, 0)),
                                           })
-        self.assertEqual(switch.vuntagged, {'1': (127, 191, 253, 15, 0, 0, 0, 0, 0),
-                                            '10': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '182': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '2': (128, 64, 0, 0, 0, 0, 0, 0, 0),
-                                            '20': (0, 0, 2, 0, 0, 0, 0, 0, 0),
-                                            '202': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '222': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '242': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '55': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '77': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '900': (0, 0, 0, 0, 0, 0, 0, 0, 0),
-                                            '998': (0, 0, 0, 0, 0, 0, 0, 0, 0)})
+        self.assertEqual(switch.vuntagged, {'1': bytes((127, 191, 253, 15, 0, 0, 0, 0, 0)),
+                                            '10': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '182': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '2': bytes((128, 64, 0, 0, 0, 0, 0, 0, 0)),
+                                            '20': bytes((0, 0, 2, 0, 0, 0, 0, 0, 0)),
+                                            '202': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '222': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '242': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '55': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '77': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '900': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0)),
+                                            '998': bytes((0, 0, 0, 0, 0, 0, 0, 0, 0))})
         check = {
             1: (['2'], ['1']),
             2: (['2'], ['1']),
@@ -386,6 +774,84 @@ class TestSwitchLoad(unittest.TestCase):
         self.assertEqual(switch.vlans, ('1', '2', '20', '4095', '55', '77'))
 
 
+# snmpwalk -One of a switch with two ethernet ports (ifIndex 49 and 50 = baseports 1 and 2) and an interface vlan
+WALK_PORTS = """\
+.1.3.6.1.2.1.2.2.1.2.49 = STRING: GigabitEthernet1/0/1
+.1.3.6.1.2.1.2.2.1.2.50 = STRING: GigabitEthernet1/0/2
+.1.3.6.1.2.1.2.2.1.2.100 = STRING: Vlan-interface1
+.1.3.6.1.2.1.2.2.1.3.49 = INTEGER: ethernetCsmacd(6)
+.1.3.6.1.2.1.2.2.1.3.50 = INTEGER: ethernetCsmacd(6)
+.1.3.6.1.2.1.2.2.1.3.100 = INTEGER: l3ipvlan(136)
+.1.3.6.1.2.1.2.2.1.5.49 = Gauge32: 1000000000
+.1.3.6.1.2.1.2.2.1.5.50 = Gauge32: 100000000
+.1.3.6.1.2.1.2.2.1.7.49 = INTEGER: up(1)
+.1.3.6.1.2.1.2.2.1.7.50 = INTEGER: down(2)
+.1.3.6.1.2.1.2.2.1.8.49 = INTEGER: up(1)
+.1.3.6.1.2.1.2.2.1.8.50 = INTEGER: down(2)
+.1.3.6.1.2.1.2.2.1.9.49 = Timeticks: (12345) 0:02:03.45
+.1.3.6.1.2.1.2.2.1.9.50 = Timeticks: (0) 0:00:00.00
+.1.3.6.1.2.1.2.2.1.10.49 = Counter32: 1000
+.1.3.6.1.2.1.2.2.1.10.50 = Counter32: 0
+.1.3.6.1.2.1.2.2.1.13.49 = Counter32: 3
+.1.3.6.1.2.1.2.2.1.13.50 = Counter32: 0
+.1.3.6.1.2.1.2.2.1.16.49 = Counter32: 2000
+.1.3.6.1.2.1.2.2.1.16.50 = Counter32: 0
+.1.3.6.1.2.1.2.2.1.19.49 = Counter32: 4
+.1.3.6.1.2.1.2.2.1.19.50 = Counter32: 0
+.1.3.6.1.2.1.10.7.2.1.19.49 = INTEGER: fullDuplex(3)
+.1.3.6.1.2.1.10.7.2.1.19.50 = INTEGER: unknown(1)
+.1.3.6.1.2.1.17.1.4.1.2.1 = INTEGER: 49
+.1.3.6.1.2.1.17.1.4.1.2.2 = INTEGER: 50
+.1.3.6.1.2.1.17.2.15.1.3.1 = INTEGER: forwarding(5)
+.1.3.6.1.2.1.17.2.15.1.3.2 = INTEGER: disabled(1)
+.1.3.6.1.2.1.17.2.15.1.4.1 = INTEGER: enabled(1)
+.1.3.6.1.2.1.17.2.15.1.4.2 = INTEGER: enabled(1)
+.1.3.6.1.2.1.17.7.1.4.5.1.1.1 = Gauge32: 1
+.1.3.6.1.2.1.17.7.1.4.5.1.1.2 = Gauge32: 20
+.1.3.6.1.2.1.31.1.1.1.6.49 = Counter64: 5000000000
+.1.3.6.1.2.1.31.1.1.1.6.50 = Counter64: 0
+.1.3.6.1.2.1.31.1.1.1.10.49 = Counter64: 6000000000
+.1.3.6.1.2.1.31.1.1.1.10.50 = Counter64: 0
+.1.3.6.1.2.1.31.1.1.1.18.49 = STRING: uplink
+.1.3.6.1.2.1.31.1.1.1.18.50 = STRING: 
+.1.3.6.1.2.1.105.1.1.1.3.1.49 = INTEGER: true(1)
+.1.3.6.1.2.1.105.1.1.1.6.1.49 = INTEGER: deliveringPower(3)
+.1.3.6.1.2.1.105.1.1.1.10.1.49 = INTEGER: class2(3)
+.1.3.6.1.4.1.43.45.1.2.23.1.1.1.1.5.49 = INTEGER: vLANTrunk(1)
+.1.3.6.1.4.1.43.45.1.2.23.1.1.1.1.5.50 = INTEGER: access(2)
+"""
+
+
+# lldpRemTable of the same switch: port 50 is a regular neighbor. On port 49, as some D-LINKs do, the chassis id row
+# (0.49.1) differs from the other columns (0.49.2), and the neighbor is registered again with a newer timeMark.
+WALK_LLDP = """\
+.1.0.8802.1.1.2.1.3.7.1.4.49 = STRING: GigabitEthernet1/0/1
+.1.0.8802.1.1.2.1.3.7.1.4.50 = STRING: GigabitEthernet1/0/2
+.1.0.8802.1.1.2.1.4.1.1.4.0.49.2 = INTEGER: macAddress(4)
+.1.0.8802.1.1.2.1.4.1.1.4.0.50.1 = INTEGER: macAddress(4)
+.1.0.8802.1.1.2.1.4.1.1.4.500.49.3 = INTEGER: macAddress(4)
+.1.0.8802.1.1.2.1.4.1.1.5.0.49.1 = Hex-STRING: 00 AA BB CC DD 00 
+.1.0.8802.1.1.2.1.4.1.1.5.0.50.1 = Hex-STRING: 00 11 22 33 44 55 
+.1.0.8802.1.1.2.1.4.1.1.5.500.49.3 = Hex-STRING: 00 AA BB CC DD 00 
+.1.0.8802.1.1.2.1.4.1.1.6.0.49.2 = INTEGER: macAddress(3)
+.1.0.8802.1.1.2.1.4.1.1.6.0.50.1 = INTEGER: interfaceName(5)
+.1.0.8802.1.1.2.1.4.1.1.6.500.49.3 = INTEGER: macAddress(3)
+.1.0.8802.1.1.2.1.4.1.1.7.0.49.2 = Hex-STRING: 00 AA BB CC DD 05 
+.1.0.8802.1.1.2.1.4.1.1.7.0.50.1 = STRING: GigabitEthernet1/0/24
+.1.0.8802.1.1.2.1.4.1.1.7.500.49.3 = Hex-STRING: 00 AA BB CC DD 07 
+.1.0.8802.1.1.2.1.4.1.1.9.0.49.2 = STRING: dlink
+.1.0.8802.1.1.2.1.4.1.1.9.0.50.1 = STRING: core
+.1.0.8802.1.1.2.1.4.1.1.12.0.49.2 = Hex-STRING: 28 
+.1.0.8802.1.1.2.1.4.1.1.12.0.50.1 = Hex-STRING: 28 
+"""
+
+def pseudo_switch(walk):
+    """ Switch over a PseudoSnmp loaded from the snmpwalk output given, with no file under PseudoSnmp.path """
+    session = PseudoSnmp('fixture')
+    session.start(walk)
+    return Switch.Switch(session)
+
+
 def override_snmp_factory(host='', community='public', version=2):
     return PseudoSnmp(host + '.snmpwalk', community, version)
 
@@ -422,5 +888,253 @@ class TestSwitchInterface(unittest.TestCase):
         switch = SwitchFactory.factory(host=session)
         switch.load()
 
+class TestSwitchWalk(unittest.TestCase):
+    """
+    Switch methods over small in-memory walks, so they run without the files of PseudoSnmp.path.
+    """
+
+    def test_get_ports(self):
+        switch = pseudo_switch(WALK_PORTS)
+        switch.get_ports()
+        # only the ethernet ports, indexed by baseport
+        self.assertEqual(sorted(switch.portas), [1, 2])
+        port = switch.portas[1]
+        self.assertEqual((port['speed'], port['duplex'], port['admin'], port['oper']), (1000, 3, 1, 1))
+        self.assertEqual((port['lastchange'], port['discards_in'], port['discards_out']), (12345, 3, 4))
+        # the 64 bits counters win over the 32 bits ones
+        self.assertEqual((port['oct_in'], port['oct_out']), (5000000000, 6000000000))
+        # columns indexed by baseport
+        self.assertEqual((port['stp_admin'], port['stp_state'], port['pvid']), (1, 5, '1'))
+        self.assertEqual((port['poe_admin'], port['poe_detection'], port['poe_class']), (1, 3, 3))
+        self.assertEqual((port['nome'], port['alias']), ('GigabitEthernet1/0/1', 'uplink'))
+        port = switch.portas[2]
+        self.assertEqual((port['speed'], port['admin'], port['stp_state'], port['pvid']), (100, 2, 1, '20'))
+        # rows missing from a column are -1, as the GETs of get_port_ether() answer
+        self.assertEqual((port['poe_admin'], port['poe_mpower']), (-1, -1))
+        # same result of the port by port load
+        for ifindex, bport in ((49, 1), (50, 2)):
+            self.assertEqual(switch.portas[bport], switch.get_port_ether(ifindex))
+
+    def test_get_lldp_neighbors(self):
+        switch = pseudo_switch(WALK_PORTS + WALK_LLDP)
+        lldp = switch.get_lldp_neighbors()
+        self.assertEqual(sorted(lldp), [49, 50])
+        self.assertEqual((lldp[50]['rmac'], lldp[50]['rport'], lldp[50]['remsysname'], lldp[50]['locportdesc']),
+                         ('00:11:22:33:44:55', '24', 'core', 'GigabitEthernet1/0/2'))
+        # the row of the other columns is found by timeMark and local port, and the second registration is ignored
+        self.assertEqual((lldp[49]['rmac'], lldp[49]['rport'], lldp[49]['remsysname'], lldp[49]['locportdesc']),
+                         ('00:aa:bb:cc:dd:00', '6', 'dlink', 'GigabitEthernet1/0/1'))
+        # columns without the row at all are '-1'
+        self.assertEqual(lldp[49]['remportdesc'], '-1')
+        self.assertEqual(Switch.Switch._lldp_row({'0.49.2': 'a', '0.50.1': 'b'}, '0.50'), 'b')
+        self.assertEqual(Switch.Switch._lldp_row({'0.49.2': 'a'}, '0.4'), '-1')
+
+
+class TestProbeHealth(TransactionTestCase):
+    def setUp(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        self.now = timezone.now()
+        # ok, save fails, doesn't answer, in back-off
+        for i, (failures, next_attempt) in enumerate(((0, None), (2, None), (0, None),
+                                                      (5, self.now + timedelta(hours=1)))):
+            Switches.objects.create(name='sw{}'.format(i), alias='sw{}'.format(i), mac='00:00:00:00:00:0{}'.format(i),
+                                    ip='10.0.0.{}'.format(i), serial_number='SN{}'.format(i), status='active',
+                                    community_ro='public', community_rw='private', uptime=timedelta(0),
+                                    probe_failures=failures, probe_next_attempt=next_attempt)
+        self.switches = list(Switches.objects.order_by('id'))
+
+    def loaded(self, sw, serial):
+        from datetime import timedelta
+        obj = Switch.Switch('')
+        obj.host, obj.mac, obj.name, obj.serial, obj.comunidade = sw.ip, sw.mac, sw.name, serial, 'public'
+        obj.descr, obj.uptime, obj.profile = '', timedelta(0), 'config'
+        return obj
+
+    def test_backoff(self):
+        from datetime import timedelta
+        ok, failed, down, waiting = self.switches
+        # the second switch loads, but its serial number belongs to the first one: the save fails
+        loaded = {ok.ip: self.loaded(ok, ok.serial_number), failed.ip: self.loaded(failed, ok.serial_number)}
+
+        async def load_host(executor, host, *args):
+            return loaded.get(host)
+
+        rows = [[sw.ip, 1, 'public', sw.id, None, None] for sw in self.switches]
+        with mock.patch('netstatus.lib.probe._load_host', load_host):
+            response = _switch_status(rows, False, 'config', cache=mock.Mock())
+        self.assertEqual(response.saved, [ok.ip])
+        self.assertEqual(response.skipped, [waiting.ip])
+        health = {sw.id: sw for sw in Switches.objects.all()}
+        self.assertEqual(health[ok.id].probe_failures, 0)
+        self.assertGreaterEqual(health[ok.id].probe_last_success, self.now)
+        self.assertIsNone(health[ok.id].probe_next_attempt)
+        # a failed save is a failure as a switch that doesn't answer
+        self.assertEqual(health[failed.id].probe_failures, 3)
+        self.assertGreaterEqual(health[failed.id].probe_next_attempt, self.now + timedelta(seconds=backoff(3)))
+        self.assertEqual(health[down.id].probe_failures, 1)
+        self.assertGreaterEqual(health[down.id].probe_next_attempt, self.now + timedelta(seconds=backoff(1)))
+        self.assertIsNone(health[down.id].probe_last_success)
+        # the ones in back-off are left alone
+        self.assertEqual((health[waiting.id].probe_failures, health[waiting.id].probe_next_attempt),
+                         (5, waiting.probe_next_attempt))
+
+
+@unittest.skipUnless(connection.vendor == 'postgresql', 'the probe job queue needs SELECT ... FOR UPDATE SKIP LOCKED')
+class TestProbeJobQueue(TransactionTestCase):
+    def setUp(self):
+        from datetime import timedelta
+        for i in range(6):
+            Switches.objects.create(name='sw{}'.format(i), alias='sw{}'.format(i), mac='00:00:00:00:00:0{}'.format(i),
+                                    ip='10.0.0.{}'.format(i), serial_number='SN{}'.format(i), status='active',
+                                    community_ro='public', community_rw='private', uptime=timedelta(0))
+        schedule({'full': 3600})
+
+    def test_claim_concurrent(self):
+        import threading
+        from django.db import connections
+        # both workers hold their transaction open at once: the second must skip the rows locked by the first
+        barrier = threading.Barrier(2, timeout=10)
+        bulk_update = ProbeJob.objects.bulk_update
+        claimed = {}
+
+        def locked(*args, **kwargs):
+            barrier.wait()
+            return bulk_update(*args, **kwargs)
+
+        def worker(owner):
+            try:
+                claimed[owner] = {job.id for job in claim(owner, 3)}
+            finally:
+                connections.close_all()
+
+        with mock.patch.object(ProbeJob.objects, 'bulk_update', side_effect=locked):
+            threads = [threading.Thread(target=worker, args=(owner,)) for owner in ('a', 'b')]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(len(claimed['a']), 3)
+        self.assertEqual(len(claimed['b']), 3)
+        self.assertFalse(claimed['a'] & claimed['b'])
+        self.assertEqual(claim('c', 10), [])
+
+    def test_lease_expired(self):
+        # worker a dies holding the jobs: b takes them when the lease expires, and a can't release them anymore
+        jobs = claim('a', 10, lease=-1)
+        self.assertEqual(len(jobs), 6)
+        again = claim('b', 10)
+        self.assertEqual({job.id for job in again}, {job.id for job in jobs})
+        self.assertEqual({job.attempts for job in again}, {2})
+        response = ProbeResponse([[job.switch.ip] for job in jobs])
+        response.saved = [job.switch.ip for job in jobs]
+        finish(jobs, response, 'a')
+        self.assertEqual(ProbeJob.objects.filter(lease_owner='b').count(), 6)
+        finish(again, response, 'b')
+        self.assertEqual(ProbeJob.objects.filter(lease_owner__isnull=True, attempts=0).count(), 6)
+        self.assertEqual(claim('c', 10), [])
+
+
+class TestPersist(TransactionTestCase):
+    def setUp(self):
+        from datetime import timedelta
+        self.switch = Switches.objects.create(name='sw', alias='sw', mac='00:00:00:00:00:01', ip='10.0.0.1',
+                                              serial_number='SN', status='active', community_ro='public',
+                                              community_rw='private', uptime=timedelta(0))
+
+    @staticmethod
+    def port(speed=1000, **kwargs):
+        pdata = {'speed': speed, 'duplex': 2, 'admin': 1, 'oper': 1, 'lastchange': 0, 'discards_in': 0,
+                 'discards_out': 0, 'oct_in': 0, 'oct_out': 0, 'stp_admin': 1, 'stp_state': 5, 'poe_admin': 0,
+                 'poe_detection': 0, 'poe_class': 0, 'poe_mpower': 0, 'pvid': 1, 'tagged': [], 'untagged': ['1'],
+                 'nome': 'port', 'alias': ''}
+        pdata.update(kwargs)
+        return pdata
+
+    def test_save_ports(self):
+        persist.save_ports(self.switch, {1: self.port(), 2: self.port(), 3: self.port()}, {1: 2, 2: 1})
+        ids = dict(SwitchesPorts.objects.filter(switch=self.switch).values_list('port', 'id'))
+        self.assertEqual(sorted(ids), [1, 2, 3])
+
+        # 1 changed, 2 unchanged, 3 is missing from the load and 4 is new
+        persist.save_ports(self.switch, {1: self.port(speed=100, tagged=['2', '3']), 2: self.port(), 4: self.port()})
+        ports = {sp.port: sp for sp in SwitchesPorts.objects.filter(switch=self.switch)}
+        self.assertEqual(sorted(ports), [1, 2, 3, 4])
+        # updated in place, so the trigger logs the change instead of a delete + insert
+        self.assertEqual({port: ports[port].id for port in ids}, ids)
+        self.assertEqual(ports[1].speed, 100)
+        self.assertEqual(ports[1].port_tagged, '2, 3')
+        self.assertEqual(ports[2].speed, 1000)
+        # without the FDB the mac_count stored is kept
+        self.assertEqual((ports[1].mac_count, ports[2].mac_count, ports[4].mac_count), (2, 1, 0))
+
+    def test_save_macs(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        persist.save_macs(self.switch, [(1, 'aa', 1), (2, 'bb', 1), (3, 'cc', 1), (3, 'aa', 2)], {'aa': '10.0.0.10'})
+        ids = {(m.mac, m.vlan): m.id for m in Mac.objects.filter(switch=self.switch)}
+        self.assertEqual(dict(Mac.objects.values_list('mac', 'ip').filter(vlan=1)),
+                         {'aa': '10.0.0.10', 'bb': '', 'cc': ''})
+        old = timezone.now() - timedelta(days=1)
+        Mac.objects.update(data=old)
+
+        # aa unchanged, bb moved, cc gone, dd new (the last entry of a duplicate wins); no core switch this time
+        bulk_update = Mac.objects.bulk_update
+        with mock.patch.object(Mac.objects, 'bulk_update', wraps=bulk_update) as update:
+            persist.save_macs(self.switch, [(1, 'aa', 1), (3, 'aa', 2), (4, 'bb', 1), (5, 'bb', 1), (6, 'dd', 1)])
+        self.assertEqual([(m.mac, m.vlan) for m in update.call_args.args[0]], [('bb', 1)])
+        macs = {(m.mac, m.vlan): m for m in Mac.objects.filter(switch=self.switch)}
+        self.assertEqual(sorted(macs), [('aa', 1), ('aa', 2), ('bb', 1), ('dd', 1)])
+        for key in (('aa', 1), ('aa', 2), ('bb', 1)):
+            self.assertEqual(macs[key].id, ids[key])
+        self.assertEqual((macs[('bb', 1)].port, macs[('dd', 1)].port), (5, 6))
+        # the IPs known are kept without a core switch, and the new MAC gets ''
+        self.assertEqual((macs[('aa', 1)].ip, macs[('bb', 1)].ip, macs[('dd', 1)].ip), ('10.0.0.10', '', ''))
+        # data is the last time each MAC was seen, moved or not
+        self.assertFalse(Mac.objects.filter(data__lte=old).exists())
+
+        # the core switch doesn't know aa anymore and bb got an IP
+        persist.save_macs(self.switch, [(1, 'aa', 1), (5, 'bb', 1)], {'bb': '10.0.0.11'})
+        self.assertEqual(dict(Mac.objects.values_list('mac', 'ip')), {'aa': '', 'bb': '10.0.0.11'})
+
+    def test_save_neighbors(self):
+        def lldp(neighbors):
+            return mock.Mock(uplink=list(neighbors), lldp={port: {'rmac': rmac, 'rport': rport}
+                                                           for port, (rmac, rport) in neighbors.items()})
+
+        SwitchesNeighbors.objects.create(mac1='00:00:00:00:00:09', port1=1, mac2='00:00:00:00:00:02', port2=7)
+        persist.save_neighbors(self.switch, lldp({1: ('00:00:00:00:00:02', 24), 2: ('00:00:00:00:00:03', 24),
+                                                  3: ('00:00:00:00:00:04', 1)}))
+        ids = {(n.port1, n.mac2): n.id for n in SwitchesNeighbors.objects.filter(mac1=self.switch.mac)}
+        self.assertEqual(len(ids), 3)
+
+        # port 1 unchanged, 2 has a new remote port, 3 is gone and 4 is new
+        persist.save_neighbors(self.switch, lldp({1: ('00:00:00:00:00:02', 24), 2: ('00:00:00:00:00:03', 23),
+                                                  4: ('00:00:00:00:00:05', 1)}))
+        neighbors = {(n.port1, n.mac2): n for n in SwitchesNeighbors.objects.filter(mac1=self.switch.mac)}
+        self.assertEqual({key: n.port2 for key, n in neighbors.items()},
+                         {(1, '00:00:00:00:00:02'): 24, (2, '00:00:00:00:00:03'): 23, (4, '00:00:00:00:00:05'): 1})
+        self.assertEqual(neighbors[(1, '00:00:00:00:00:02')].id, ids[(1, '00:00:00:00:00:02')])
+        self.assertEqual(neighbors[(2, '00:00:00:00:00:03')].id, ids[(2, '00:00:00:00:00:03')])
+        # the neighbors of other switches are left alone
+        self.assertTrue(SwitchesNeighbors.objects.filter(mac1='00:00:00:00:00:09', port2=7).exists())
+
+    def test_save_mac_count(self):
+        # duplicates (same mac and vlan) are counted once, in the port save_macs() keeps
+        mac_count = persist.count_macs([(1, 'aa', 1), (1, 'bb', 1), (2, 'aa', 2), (3, 'bb', 1), (1, 'cc', 1)])
+        self.assertEqual(mac_count, {1: 2, 2: 1, 3: 1})
+        persist.save_ports(self.switch, {1: self.port(), 2: self.port(), 3: self.port(), 4: self.port()}, {4: 5})
+
+        bulk_update = SwitchesPorts.objects.bulk_update
+        with mock.patch.object(SwitchesPorts.objects, 'bulk_update', wraps=bulk_update) as update:
+            persist.save_mac_count(self.switch, mac_count)
+        self.assertEqual(sorted(sp.port for sp in update.call_args.args[0]), [1, 2, 3, 4])
+        self.assertEqual(dict(SwitchesPorts.objects.values_list('port', 'mac_count')), {1: 2, 2: 1, 3: 1, 4: 0})
+        # only the ports whose count changed are written
+        with mock.patch.object(SwitchesPorts.objects, 'bulk_update', wraps=bulk_update) as update:
+            persist.save_mac_count(self.switch, {1: 2, 2: 1, 3: 0})
+        self.assertEqual([sp.port for sp in update.call_args.args[0]], [3])
+        self.assertEqual(dict(SwitchesPorts.objects.values_list('port', 'mac_count')), {1: 2, 2: 1, 3: 0, 4: 0})
+
 if __name__ == '__main__':
     unittest.main()
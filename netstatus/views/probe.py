@@ -1,12 +1,11 @@
 from django.http import StreamingHttpResponse, HttpResponse
 from django.shortcuts import render
-from netsnmp._api import SNMPError
 
 from netstatus.lib.snmpprinter import probe_snmp_printer
 from netstatus.lib.probe import probe_update_host, probe_update_db, inspect_host
 from netstatus.lib.neighbors import probe_switch_neighbors
 
-from netstatus.lib.snmp import PseudoSnmp
+from netstatus.lib.snmp import PseudoSnmp, SNMPError
 
 
 def probe_view(request):
@@ -34,7 +33,7 @@ def probe_service(request, service, target='', community='public'):
         return render(request, 'probe_result.html', {'general': response.all, 'hosts': response.hosts})
 
     elif service == 'updatedb':
-        response = probe_update_db(dryrun)
+        response = probe_update_db(dryrun, request.GET.get('profile', 'full'))
         return render(request, 'probe_result.html', {'general': response.all, 'hosts': response.hosts})
 
     else:
@@ -61,4 +60,6 @@ def inspect_service(request, target='', community='public'):
     # TODO: add a failure template
     obj.mask__name = obj._mask.__name__
     obj.class__name = obj.__class__.__name__
-    return render(request, 'inspect-host.html', {'switch': obj})
+    response = render(request, 'inspect-host.html', {'switch': obj})
+    obj.close()
+    return response
@@ -305,6 +305,24 @@ CREATE RULE mac_log AS
             now() AS now;
 
 
+--
+-- Name: mac mac_log_u; Type: RULE; Schema: public; Owner: -
+-- The probe updates the MACs in place: the last seen date of all of them, plus the port / IP of the ones that
+-- moved. Only a move is logged, with the old row. Also created by migration 0008 on older databases.
+--
+
+CREATE RULE mac_log_u AS
+    ON UPDATE TO public.mac
+    WHERE old.port <> new.port OR old.ip IS DISTINCT FROM new.ip
+    DO  INSERT INTO public.mac_log (switch, mac, port, vlan, ip, data, tstamp)  SELECT old.switch,
+            old.mac,
+            old.port,
+            old.vlan,
+            old.ip,
+            old.data,
+            now() AS now;
+
+
 --
 -- Name: switches switches_log_d; Type: RULE; Schema: public; Owner: -
 --